@@ -11,19 +11,26 @@ with patch('src.services.polling.poll_for_alerts', new=AsyncMock()), \
      patch('src.db.database.init_db', new=AsyncMock()), \
      patch('src.db.database.close_db', new=AsyncMock()):
     from src.api.main import app
+from src.core.state import _recent_alerts
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def live_server():
     """
     Creates a live server for integration testing.
     Returns the base URL of the server.
     """
-    # Use TestClient for synchronous testing of FastAPI apps
-    client = TestClient(app)
     return "http://testserver"
 
 
+@pytest.fixture(autouse=True)
+def clear_recent_alerts():
+    """Forget alerts seen by duplicate detection so tests don't affect each other."""
+    _recent_alerts.clear()
+    yield
+    _recent_alerts.clear()
+
+
 @pytest.fixture(scope="session")
 def event_loop():
     """Create an instance of the default event loop for the test session."""
@@ -32,9 +39,11 @@ def event_loop():
     loop.close()
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def client():
     """
-    FastAPI TestClient fixture for testing the application.
+    FastAPI TestClient fixture shared by the whole test session.
+    The app lifespan runs once on entry and once on exit.
     """
-    return TestClient(app)
\ No newline at end of file
+    with TestClient(app) as c:
+        yield c
@@ -36,13 +36,20 @@ Environment Variables:
 from __future__ import annotations
 
 import argparse
-import json
+import asyncio
 import logging
 import os
+import re
 import sys
-import time
+from typing import AsyncIterable, AsyncIterator, Callable
 
 import httpx
+import orjson
+
+try:
+    import uvloop
+except ImportError:  # optional: falls back to the default asyncio loop
+    uvloop = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -53,6 +60,11 @@ log = logging.getLogger("sse-bridge")
 DEFAULT_SSE_URL = "http://localhost:8002/api/alerts-stream"
 DEFAULT_HOOK_URL = "http://127.0.0.1:18789/hooks/agent"
 
+# Alerts arriving within this window after a webhook post are merged into one message
+BATCH_WINDOW_SECONDS = 0.2
+# Matched alerts waiting for delivery; if the webhook stalls, the oldest are dropped first
+ALERT_QUEUE_SIZE = 100
+
 
 def parse_args():
     p = argparse.ArgumentParser(description="SSE → OpenClaw webhook bridge for Pikud HaOref alerts")
@@ -68,9 +80,30 @@ def parse_args():
     return p.parse_args()
 
 
-def city_matches(alert_cities: list[str], watch_cities: set[str]) -> list[str]:
+async def iter_sse_data(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Yield the payload of every `data: ` line in a raw SSE byte stream."""
+    buf = bytearray()
+    async for chunk in chunks:
+        buf.extend(chunk)
+        while (nl := buf.find(b"\n")) != -1:
+            line = bytes(buf[:nl]).rstrip(b"\r")
+            del buf[:nl + 1]
+            if line.startswith(b"data: "):
+                yield line[6:]
+
+
+def build_city_matcher(watch_cities: set[str]) -> Callable[[str], bool]:
+    """Build a predicate that tells whether a city name contains any watched city."""
+    if len(watch_cities) <= 2:
+        return lambda city: any(w in city for w in watch_cities)
+    # One compiled alternation scans each city once instead of once per watched name
+    pattern = re.compile("|".join(re.escape(w) for w in watch_cities))
+    return lambda city: pattern.search(city) is not None
+
+
+def city_matches(alert_cities: list[str], matcher: Callable[[str], bool]) -> list[str]:
     """Return the subset of alert cities that match our watch list."""
-    return [c for c in alert_cities if any(w in c for w in watch_cities)]
+    return [c for c in alert_cities if matcher(c)]
 
 
 def build_message(alert: dict, matched_cities: list[str]) -> str:
@@ -89,7 +122,12 @@ def build_message(alert: dict, matched_cities: list[str]) -> str:
     return msg
 
 
-def forward_to_openclaw(hook_url: str, token: str, message: str, channel: str, to: str | None):
+def build_batch_message(batch: list[tuple[dict, list[str]]]) -> str:
+    """Build one message covering every (alert, matched cities) pair in a batch."""
+    return "\n".join(build_message(alert, matched) for alert, matched in batch)
+
+
+async def forward_to_openclaw(client: httpx.AsyncClient, hook_url: str, message: str, channel: str, to: str | None):
     """POST to OpenClaw /hooks/agent."""
     payload: dict = {
         "message": (
@@ -105,68 +143,108 @@ def forward_to_openclaw(hook_url: str, token: str, message: str, channel: str, t
     if to:
         payload["to"] = to
 
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-
-    resp = httpx.post(hook_url, json=payload, headers=headers, timeout=15)
+    resp = await client.post(hook_url, json=payload)
     if resp.status_code in (200, 202):
         log.info("✅ Alert forwarded to OpenClaw → %s", channel)
     else:
         log.error("❌ OpenClaw webhook returned %s: %s", resp.status_code, resp.text)
 
 
-def listen(args):
-    """Connect to SSE stream and process events."""
-    watch_cities = {c.strip() for c in args.cities.split(",") if c.strip()}
-    log.info("👀 Watching cities: %s", watch_cities)
-    log.info("📡 SSE: %s", args.sse_url)
-    log.info("🔗 Hook: %s", args.hook_url)
-    log.info("📱 Deliver: %s → %s", args.channel, args.to or "(last)")
+async def collect_batch(queue: asyncio.Queue, window: float) -> list[tuple[dict, list[str]]]:
+    """Collect whatever arrives on the queue within `window` seconds."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + window
+    batch = []
+    while (remaining := deadline - loop.time()) > 0:
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
 
+
+async def deliver_alerts(queue: asyncio.Queue, client: httpx.AsyncClient, args):
+    """Forward matched alerts to OpenClaw, merging bursts into a single webhook call."""
+    while True:
+        # The first alert after a quiet period goes out immediately
+        batch = [await queue.get()]
+        while batch:
+            try:
+                await forward_to_openclaw(client, args.hook_url, build_batch_message(batch), args.channel, args.to)
+            except httpx.HTTPError as e:
+                log.error("❌ OpenClaw webhook failed: %s", e)
+            except Exception:
+                # Keep delivering later alerts even if one batch can't be built or sent
+                log.exception("❌ Failed to forward %d alert(s) to OpenClaw", len(batch))
+            batch = await collect_batch(queue, BATCH_WINDOW_SECONDS)
+
+
+async def read_alerts(client: httpx.AsyncClient, sse_url: str, matcher: Callable[[str], bool], queue: asyncio.Queue):
+    """Read the SSE stream, queueing every alert that matches the watch list."""
     backoff = 2
     while True:
         try:
-            with httpx.Client(timeout=None) as client:
-                with client.stream("GET", args.sse_url) as resp:
-                    if resp.status_code != 200:
-                        log.error("SSE returned %s", resp.status_code)
-                        time.sleep(backoff)
-                        backoff = min(backoff * 2, 60)
+            async with client.stream("GET", sse_url) as resp:
+                if resp.status_code != 200:
+                    log.error("SSE returned %s", resp.status_code)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+                    continue
+
+                backoff = 2
+                log.info("✅ Connected to SSE stream")
+
+                async for data in iter_sse_data(resp.aiter_bytes(8192)):
+                    if data.strip() == b"keep-alive":
                         continue
 
-                    backoff = 2
-                    log.info("✅ Connected to SSE stream")
-
-                    for line in resp.iter_lines():
-                        if not line.startswith("data: "):
-                            continue
-                        data = line[6:]
-                        if data.strip() == "keep-alive":
-                            continue
-
-                        try:
-                            alert = json.loads(data)
-                        except json.JSONDecodeError:
-                            continue
+                    try:
+                        alert = orjson.loads(data)
+                    except orjson.JSONDecodeError:
+                        continue
 
-                        cities = alert.get("cities", alert.get("data", []))
-                        matched = city_matches(cities, watch_cities)
-                        if not matched:
-                            continue
+                    cities = alert.get("cities", alert.get("data", []))
+                    matched = city_matches(cities, matcher)
+                    if not matched:
+                        continue
 
-                        log.warning("🚨 ALERT matches %s: %s", matched, alert.get("type"))
-                        message = build_message(alert, matched)
-                        forward_to_openclaw(args.hook_url, args.hook_token, message, args.channel, args.to)
+                    log.warning("🚨 ALERT matches %s: %s", matched, alert.get("type"))
+                    if queue.full():
+                        dropped, _ = queue.get_nowait()
+                        log.error("Delivery queue full, dropping oldest alert %s", dropped.get("id"))
+                    queue.put_nowait((alert, matched))
 
         except (httpx.ConnectError, httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
             log.warning("SSE disconnected (%s), reconnecting in %ds...", e, backoff)
-            time.sleep(backoff)
+            await asyncio.sleep(backoff)
             backoff = min(backoff * 2, 60)
-        except KeyboardInterrupt:
-            log.info("Stopped.")
-            sys.exit(0)
+
+
+async def listen(args):
+    """Connect to SSE stream and process events."""
+    watch_cities = {c.strip() for c in args.cities.split(",") if c.strip()}
+    matcher = build_city_matcher(watch_cities)
+    log.info("👀 Watching cities: %s", watch_cities)
+    log.info("📡 SSE: %s", args.sse_url)
+    log.info("🔗 Hook: %s", args.hook_url)
+    log.info("📱 Deliver: %s → %s", args.channel, args.to or "(last)")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=ALERT_QUEUE_SIZE)
+    # Both clients live for the whole run so reconnects and webhook posts reuse connections
+    hook_client = httpx.AsyncClient(
+        http2=True,
+        timeout=15,
+        headers={
+            "Authorization": f"Bearer {args.hook_token}",
+            "Content-Type": "application/json",
+        },
+    )
+    async with hook_client, httpx.AsyncClient(timeout=None) as sse_client:
+        deliver_task = asyncio.create_task(deliver_alerts(queue, hook_client, args))
+        try:
+            await read_alerts(sse_client, args.sse_url, matcher, queue)
+        finally:
+            deliver_task.cancel()
 
 
 def main():
@@ -174,7 +252,13 @@ def main():
     if not args.hook_token:
         log.error("OPENCLAW_HOOK_TOKEN is required (--hook-token or env var)")
         sys.exit(1)
-    listen(args)
+    try:
+        if uvloop is not None:
+            uvloop.run(listen(args))
+        else:
+            asyncio.run(listen(args))
+    except KeyboardInterrupt:
+        log.info("Stopped.")
 
 
 if __name__ == "__main__":
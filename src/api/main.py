@@ -1,22 +1,26 @@
 import asyncio
 import logging
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import Enum
+from secrets import token_hex
+from types import MappingProxyType
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
 from dotenv import load_dotenv
 # Rate limiting imports disabled (not needed for emergency alerts)
-# from slowapi.errors import RateLimitExceeded  
-# from slowapi.middleware import SlowAPIMiddleware
+# from slowapi import _rate_limit_exceeded_handler
+# from slowapi.errors import RateLimitExceeded
 from pydantic import BaseModel
 from typing import List, Optional
 
 # Local imports - must be direct, not relative
 from ..services.polling import poll_for_alerts
-from ..utils.security import geo_ip_middleware, get_api_key, limiter
-from ..services.sse import alert_event_generator
-from ..core.state import app_state
-from ..core.alert_queue import alert_queue
-from ..db.database import init_db, close_db, save_alert, get_alerts_by_city, get_recent_alerts, get_alert_stats, get_all_cities
+from ..utils.security import close_geoip_reader, get_api_key, limiter, open_geoip_reader, require_israel_ip
+from ..services.sse import SSE_HEADERS, alert_event_generator, encode_alert_event, gzip_event_stream
+from ..core.state import app_state, forget_alert, is_duplicate_alert, DUPLICATE_WINDOW_SECONDS
+from ..core.alert_queue import alert_hub
+from ..db.database import init_db, close_db, save_alerts, get_alerts_by_city, get_recent_alerts, get_alert_stats, get_all_cities
 
 # Load environment variables from .env file at the start
 load_dotenv()
@@ -25,96 +29,134 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Alert category mappings with Hebrew and English descriptions
-ALERT_CATEGORIES = {
-    "1": {
-        "type": "missiles",
-        "title_he": "התרעת צבע אדום",
-        "title_en": "Red Alert - Missile Threat",
-        "description_he": "היכנסו למרחב המוגן, סגרו דלתות וחלונות",
-        "description_en": "Enter protected space, close doors and windows",
-        "instructions_he": "היכנסו למבנה, נעלו את הדלתות וסגרו את החלונות",
-        "instructions_en": "Enter a building, lock the doors and close the windows"
-    },
-    "2": {
-        "type": "radiologicalEvent", 
-        "title_he": "אירוע רדיולוגי",
-        "title_en": "Radiological Event",
-        "description_he": "התרחקו מהאזור, הישארו במבנה סגור",
-        "description_en": "Stay away from the area, remain in a closed building",
-        "instructions_he": "התרחקו מהאזור, הישארו במבנה סגור",
-        "instructions_en": "Stay away from the area, remain in a closed building"
-    },
-    "3": {
-        "type": "earthQuake",
-        "title_he": "רעידת אדמה", 
-        "title_en": "Earthquake",
-        "description_he": "צאו למקום פתוח, הרחק ממבנים",
-        "description_en": "Go to an open area, away from buildings",
-        "instructions_he": "צאו למקום פתוח, הרחק ממבנים",
-        "instructions_en": "Go to an open area, away from buildings"
-    },
-    "4": {
-        "type": "tsunami",
-        "title_he": "צונאמי",
-        "title_en": "Tsunami", 
-        "description_he": "התרחקו מקו החוף, עלו למקום גבוה",
-        "description_en": "Stay away from the coastline, go to high ground",
-        "instructions_he": "התרחקו מקו החוף, עלו למקום גבוה",
-        "instructions_en": "Stay away from the coastline, go to high ground"
-    },
-    "5": {
-        "type": "hostileAircraftIntrusion",
-        "title_he": "חדירת כלי טיס עוין",
-        "title_en": "Hostile Aircraft Intrusion",
-        "description_he": "היכנסו למבנה, הישארו רחוק מחלונות",
-        "description_en": "Enter a building, stay away from windows",
-        "instructions_he": "היכנסו למבנה, הישארו רחוק מחלונות",
-        "instructions_en": "Enter a building, stay away from windows"
-    },
-    "6": {
-        "type": "hazardousMaterials",
-        "title_he": "חומרים מסוכנים",
-        "title_en": "Hazardous Materials",
-        "description_he": "סגרו חלונות ודלתות, כבו מזגנים",
-        "description_en": "Close windows and doors, turn off air conditioning",
-        "instructions_he": "סגרו חלונות ודלתות, כבו מזגנים",
-        "instructions_en": "Close windows and doors, turn off air conditioning"
-    },
-    "7": {
-        "type": "terroristInfiltration",
-        "title_he": "חדירת מחבלים",
-        "title_en": "Terrorist Infiltration",
-        "description_he": "נעלו דלתות, הימנעו מיציאה",
-        "description_en": "Lock doors, avoid going outside",
-        "instructions_he": "נעלו דלתות, הימנעו מיציאה", 
-        "instructions_en": "Lock doors, avoid going outside"
-    },
-    "101": {
-        "type": "missilesDrill",
-        "title_he": "תרגיל - התרעת צבע אדום",
-        "title_en": "Drill - Red Alert",
-        "description_he": "זהו תרגיל - פעלו כמו באירוע אמיתי",
-        "description_en": "This is a drill - act as in a real event", 
-        "instructions_he": "זהו תרגיל - היכנסו למרחב המוגן",
-        "instructions_en": "This is a drill - enter protected space"
-    },
-    "102": {
-        "type": "generalDrill",
-        "title_he": "תרגיל כללי",
-        "title_en": "General Drill",
-        "description_he": "זהו תרגיל - פעלו לפי ההוראות",
-        "description_en": "This is a drill - follow instructions",
-        "instructions_he": "זהו תרגיל - פעלו לפי ההוראות",
-        "instructions_en": "This is a drill - follow instructions"
-    }
-}
+@dataclass(frozen=True, slots=True)
+class AlertCategory:
+    """Static Hebrew/English texts for a single alert category."""
+    type: str
+    title_he: str
+    title_en: str
+    description_he: str
+    description_en: str
+    instructions_he: str
+    instructions_en: str
+
+class AlertCategoryId(str, Enum):
+    """Valid alert category ids, so unknown categories are rejected when the request is parsed."""
+    MISSILES = "1"
+    RADIOLOGICAL_EVENT = "2"
+    EARTHQUAKE = "3"
+    TSUNAMI = "4"
+    HOSTILE_AIRCRAFT_INTRUSION = "5"
+    HAZARDOUS_MATERIALS = "6"
+    TERRORIST_INFILTRATION = "7"
+    MISSILES_DRILL = "101"
+    GENERAL_DRILL = "102"
+
+# Alert category mappings with Hebrew and English descriptions (read-only)
+ALERT_CATEGORIES = MappingProxyType({
+    "1": AlertCategory(
+        type="missiles",
+        title_he="התרעת צבע אדום",
+        title_en="Red Alert - Missile Threat",
+        description_he="היכנסו למרחב המוגן, סגרו דלתות וחלונות",
+        description_en="Enter protected space, close doors and windows",
+        instructions_he="היכנסו למבנה, נעלו את הדלתות וסגרו את החלונות",
+        instructions_en="Enter a building, lock the doors and close the windows",
+    ),
+    "2": AlertCategory(
+        type="radiologicalEvent",
+        title_he="אירוע רדיולוגי",
+        title_en="Radiological Event",
+        description_he="התרחקו מהאזור, הישארו במבנה סגור",
+        description_en="Stay away from the area, remain in a closed building",
+        instructions_he="התרחקו מהאזור, הישארו במבנה סגור",
+        instructions_en="Stay away from the area, remain in a closed building",
+    ),
+    "3": AlertCategory(
+        type="earthQuake",
+        title_he="רעידת אדמה",
+        title_en="Earthquake",
+        description_he="צאו למקום פתוח, הרחק ממבנים",
+        description_en="Go to an open area, away from buildings",
+        instructions_he="צאו למקום פתוח, הרחק ממבנים",
+        instructions_en="Go to an open area, away from buildings",
+    ),
+    "4": AlertCategory(
+        type="tsunami",
+        title_he="צונאמי",
+        title_en="Tsunami",
+        description_he="התרחקו מקו החוף, עלו למקום גבוה",
+        description_en="Stay away from the coastline, go to high ground",
+        instructions_he="התרחקו מקו החוף, עלו למקום גבוה",
+        instructions_en="Stay away from the coastline, go to high ground",
+    ),
+    "5": AlertCategory(
+        type="hostileAircraftIntrusion",
+        title_he="חדירת כלי טיס עוין",
+        title_en="Hostile Aircraft Intrusion",
+        description_he="היכנסו למבנה, הישארו רחוק מחלונות",
+        description_en="Enter a building, stay away from windows",
+        instructions_he="היכנסו למבנה, הישארו רחוק מחלונות",
+        instructions_en="Enter a building, stay away from windows",
+    ),
+    "6": AlertCategory(
+        type="hazardousMaterials",
+        title_he="חומרים מסוכנים",
+        title_en="Hazardous Materials",
+        description_he="סגרו חלונות ודלתות, כבו מזגנים",
+        description_en="Close windows and doors, turn off air conditioning",
+        instructions_he="סגרו חלונות ודלתות, כבו מזגנים",
+        instructions_en="Close windows and doors, turn off air conditioning",
+    ),
+    "7": AlertCategory(
+        type="terroristInfiltration",
+        title_he="חדירת מחבלים",
+        title_en="Terrorist Infiltration",
+        description_he="נעלו דלתות, הימנעו מיציאה",
+        description_en="Lock doors, avoid going outside",
+        instructions_he="נעלו דלתות, הימנעו מיציאה",
+        instructions_en="Lock doors, avoid going outside",
+    ),
+    "101": AlertCategory(
+        type="missilesDrill",
+        title_he="תרגיל - התרעת צבע אדום",
+        title_en="Drill - Red Alert",
+        description_he="זהו תרגיל - פעלו כמו באירוע אמיתי",
+        description_en="This is a drill - act as in a real event",
+        instructions_he="זהו תרגיל - היכנסו למרחב המוגן",
+        instructions_en="This is a drill - enter protected space",
+    ),
+    "102": AlertCategory(
+        type="generalDrill",
+        title_he="תרגיל כללי",
+        title_en="General Drill",
+        description_he="זהו תרגיל - פעלו לפי ההוראות",
+        description_en="This is a drill - follow instructions",
+        instructions_he="זהו תרגיל - פעלו לפי ההוראות",
+        instructions_en="This is a drill - follow instructions",
+    )
+})
+
+# Static part of the fake-alert response details per category, built once at import
+_DETAILS_TEMPLATE = MappingProxyType({
+    cat: MappingProxyType({
+        "type": info.type,
+        "category": cat,
+        "title_he": info.title_he,
+        "title_en": info.title_en,
+        "description_he": info.description_he,
+        "description_en": info.description_en,
+        "instructions_he": info.instructions_he,
+        "instructions_en": info.instructions_en,
+    })
+    for cat, info in ALERT_CATEGORIES.items()
+})
 
 # Pydantic models for API request/response
 class FakeAlert(BaseModel):
     """Model for creating fake alerts for testing purposes"""
     data: List[str]  # List of affected areas/cities
-    cat: str = "1"  # Alert category (1=missile threat, 2=terrorist infiltration, etc.)
+    cat: AlertCategoryId = AlertCategoryId.MISSILES  # Alert category (1=missile threat, 2=radiological event, etc.)
     title: Optional[str] = None  # Alert title (auto-generated if not provided)
     desc: Optional[str] = None  # Alert description (auto-generated if not provided)
     language: str = "he"  # Language for auto-generated content (he/en)
@@ -126,6 +168,87 @@ class AlertResponse(BaseModel):
     alert_id: Optional[str] = None
     alert_details: Optional[dict] = None
 
+# Response models for the history endpoints. Declaring them lets FastAPI serialize
+# responses straight to JSON with pydantic-core instead of jsonable_encoder + json.dumps.
+class AlertHistoryResponse(BaseModel):
+    """Model for a list of stored alerts"""
+    alerts: List[dict]
+    count: int
+
+class CityAlertsResponse(BaseModel):
+    """Model for the stored alerts of a single city"""
+    city: str
+    alerts: List[dict]
+    count: int
+
+class AlertStatsResponse(BaseModel):
+    """Model for aggregate alert statistics"""
+    total_alerts: int
+    total_city_entries: int
+    top_cities: List[dict]
+
+class CitiesResponse(BaseModel):
+    """Model for the list of known cities"""
+    cities: List[dict]
+    count: int
+
+# Write-behind queue so API handlers don't wait on SQLite commits
+PERSIST_QUEUE_SIZE = 1000
+PERSIST_BATCH_SIZE = 64
+# How long a fake alert may wait for room in a full queue before the request is rejected
+PERSIST_PUT_TIMEOUT_SECONDS = 0.5
+# How long shutdown waits for queued alerts to be written before giving up on them
+PERSIST_SHUTDOWN_TIMEOUT_SECONDS = 10
+_persist_queue: asyncio.Queue = asyncio.Queue(maxsize=PERSIST_QUEUE_SIZE)
+# Size of the batch the worker is currently saving
+_persist_in_flight = 0
+
+def _drain_persist_queue(first: Optional[dict] = None) -> List[dict]:
+    """Collects up to PERSIST_BATCH_SIZE alerts that are already waiting to be saved."""
+    batch = [first] if first is not None else []
+    while len(batch) < PERSIST_BATCH_SIZE:
+        try:
+            batch.append(_persist_queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
+
+async def _persist_worker():
+    """Background task that saves queued alerts to SQLite in batches."""
+    global _persist_in_flight
+    while True:
+        batch = _drain_persist_queue(await _persist_queue.get())
+        _persist_in_flight = len(batch)
+        if len(batch) == PERSIST_BATCH_SIZE:
+            logger.warning(f"Persist queue backlog: {_persist_queue.qsize()} alert(s) still waiting")
+        try:
+            await save_alerts(batch)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(batch)} alert(s): {e}", exc_info=True)
+        finally:
+            _persist_in_flight = 0
+            for _ in batch:
+                _persist_queue.task_done()
+
+async def _stop_persist_worker(persist_task: asyncio.Task):
+    """
+    Stops the persist worker once everything queued has been written.
+
+    Waiting for the queue to be processed, rather than cancelling right away, lets the
+    batch the worker is already saving commit instead of being rolled back. If the
+    database can't keep up (locked, disk full), it gives up after
+    PERSIST_SHUTDOWN_TIMEOUT_SECONDS so shutdown can't hang.
+    """
+    try:
+        await asyncio.wait_for(_persist_queue.join(), timeout=PERSIST_SHUTDOWN_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.error(
+            f"Persist queue not flushed within {PERSIST_SHUTDOWN_TIMEOUT_SECONDS}s; dropping "
+            f"{_persist_queue.qsize() + _persist_in_flight} unsaved alert(s)"
+        )
+    persist_task.cancel()
+    await asyncio.gather(persist_task, return_exceptions=True)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -133,11 +256,17 @@ async def lifespan(app: FastAPI):
     """
     logger.info("Application startup: Initializing database and background tasks.")
     await init_db()
+    open_geoip_reader()
     poll_task = asyncio.create_task(poll_for_alerts())
+    persist_task = asyncio.create_task(_persist_worker())
     yield
     logger.info("Application shutdown: Cleaning up resources.")
     poll_task.cancel()
+    await asyncio.gather(poll_task, return_exceptions=True)
+    # Flush anything still waiting to be written before closing the database
+    await _stop_persist_worker(persist_task)
     await close_db()
+    close_geoip_reader()
 
 app = FastAPI(
     title="Pikud Haoref Real-Time Alert Service",
@@ -148,14 +277,22 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
-# Add the Geo-IP middleware to the application
-app.middleware("http")(geo_ip_middleware)
-
 # Rate limiting disabled for emergency alert system
-# Emergency alerts require immediate access during critical situations
+# Emergency alerts require immediate access during critical situations.
+# If re-enabled, register only the limiter and its handler and decorate the specific
+# routes with @limiter.limit(...); don't add SlowAPIMiddleware, which runs on every request.
 # app.state.limiter = limiter
 # app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-# app.add_middleware(SlowAPIMiddleware)
+
+def _event_stream_response(request: Request) -> StreamingResponse:
+    """Builds the SSE response for a client, gzip-compressed when the client accepts it."""
+    events = alert_event_generator(request)
+    headers = dict(SSE_HEADERS)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        events = gzip_event_stream(events)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(events, media_type="text/event-stream", headers=headers)
 
 @app.get("/", summary="Service Status")
 async def root():
@@ -165,7 +302,7 @@ async def root():
     """
     return {"message": "Welcome to the Pikud Haoref Real-Time Alert Service"}
 
-@app.get("/api/alerts-stream", summary="Real-Time Alert Stream")
+@app.get("/api/alerts-stream", summary="Real-Time Alert Stream", dependencies=[Depends(require_israel_ip)])
 # Note: No rate limiting for emergency alerts - people need immediate access during emergencies
 async def alerts_stream(request: Request, api_key: str = Depends(get_api_key)):
     """
@@ -174,7 +311,7 @@ async def alerts_stream(request: Request, api_key: str = Depends(get_api_key)):
     This endpoint keeps the connection open and streams new alerts as they
     become available from the background polling service.
     """
-    return StreamingResponse(alert_event_generator(request), media_type="text/event-stream")
+    return _event_stream_response(request)
 
 @app.get("/api/webhook/alerts", summary="Internal Alert Webhook")
 async def alerts_webhook(request: Request, api_key: str = Depends(get_api_key)):
@@ -185,7 +322,7 @@ async def alerts_webhook(request: Request, api_key: str = Depends(get_api_key)):
     This endpoint is designed for server-to-server communication and requires
     the same API key authentication as the client endpoint for security.
     """
-    return StreamingResponse(alert_event_generator(request), media_type="text/event-stream")
+    return _event_stream_response(request)
 
 @app.post("/api/test/fake-alert", summary="Create Fake Alert for Testing", response_model=AlertResponse)
 # Note: No rate limiting on test endpoint for easier development and testing
@@ -233,62 +370,74 @@ async def create_fake_alert(request: Request, fake_alert: FakeAlert, api_key: st
     }
     ```
     """
-    import uuid
-    
     # Generate a unique alert ID
-    alert_id = str(uuid.uuid4())[:8]
+    alert_id = token_hex(4)
     
-    # Get category information
-    category_info = ALERT_CATEGORIES.get(fake_alert.cat, ALERT_CATEGORIES["1"])
+    # Get category information (unknown languages fall back to Hebrew)
+    category = fake_alert.cat.value
+    category_info = ALERT_CATEGORIES[category]
+    alert_type = category_info.type
+    if fake_alert.language == "en":
+        default_title, default_desc, instructions = (
+            category_info.title_en, category_info.description_en, category_info.instructions_en
+        )
+    else:
+        default_title, default_desc, instructions = (
+            category_info.title_he, category_info.description_he, category_info.instructions_he
+        )
     
     # Auto-generate title and description if not provided
-    title = fake_alert.title
-    desc = fake_alert.desc
-    
-    if not title:
-        title = category_info.get(f"title_{fake_alert.language}", category_info["title_he"])
-    
-    if not desc:
-        desc = category_info.get(f"description_{fake_alert.language}", category_info["description_he"])
+    title = fake_alert.title or default_title
+    desc = fake_alert.desc or default_desc
     
     # Create the alert data structure matching the real API format
     alert_data = {
         "id": alert_id,
         "data": fake_alert.data,
-        "cat": fake_alert.cat,
+        "cat": category,
         "title": title,
         "desc": desc
     }
     
-    # Create enhanced alert details for response
+    # Create enhanced alert details for response: static category texts plus per-request fields
     alert_details = {
         "id": alert_id,
-        "type": category_info["type"],
-        "category": fake_alert.cat,
+        **_DETAILS_TEMPLATE[category],
         "areas": fake_alert.data,
-        "title_he": category_info["title_he"],
-        "title_en": category_info["title_en"],
-        "description_he": category_info["description_he"], 
-        "description_en": category_info["description_en"],
-        "instructions_he": category_info["instructions_he"],
-        "instructions_en": category_info["instructions_en"],
         "language_used": fake_alert.language,
         "title_sent": title,
         "description_sent": desc
     }
     
-    # Add the fake alert to the queue for SSE broadcasting
+    if is_duplicate_alert(category, fake_alert.data, source="fake"):
+        return AlertResponse(
+            success=True,
+            message=f"Identical alert already sent in the last {DUPLICATE_WINDOW_SECONDS}s; not broadcast again",
+            alert_details=alert_details
+        )
+    
+    # Queue for SQLite so it appears in history/city queries (written in the background).
+    # If the writer can't keep up, reject the alert rather than buffering without limit.
+    structured = {
+        "id": alert_id,
+        "type": alert_type,
+        "cities": fake_alert.data,
+        "instructions": instructions,
+    }
+    try:
+        await asyncio.wait_for(_persist_queue.put(structured), timeout=PERSIST_PUT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning(f"Persist queue saturated ({_persist_queue.qsize()} alerts), rejecting fake alert")
+        # Nothing was sent, so a retry must not be treated as a duplicate of this alert
+        forget_alert(category, fake_alert.data, source="fake")
+        raise HTTPException(status_code=503, detail="Alert queue saturated, try again later")
+
+    # Add the fake alert to the queue for SSE broadcasting, serialized once up front
     try:
-        await alert_queue.put(alert_data)
-        # Also persist to SQLite so it appears in history/city queries
-        structured = {
-            "id": alert_id,
-            "type": category_info["type"],
-            "cities": fake_alert.data,
-            "instructions": category_info.get(f"instructions_{fake_alert.language}", ""),
-        }
-        await save_alert(structured)
-        logger.info(f"Fake alert created: {alert_id} - {title} (Category: {fake_alert.cat}, Type: {category_info['type']})")
+        alert_hub.publish(encode_alert_event(alert_data))
+        # Wake the poller so it checks the upstream API right away
+        app_state.alert_hint.set()
+        logger.info(f"Fake alert created: {alert_id} - {title} (Category: {category}, Type: {alert_type})")
         
         return AlertResponse(
             success=True,
@@ -317,7 +466,7 @@ async def get_current_alerts():
     return {"active": False, "last_alert_id": None}
 
 
-@app.get("/api/alerts/history", summary="Alert History")
+@app.get("/api/alerts/history", summary="Alert History", response_model=AlertHistoryResponse)
 async def get_alert_history(
     city: Optional[str] = None,
     limit: int = 50,
@@ -338,7 +487,7 @@ async def get_alert_history(
     return {"alerts": alerts, "count": len(alerts)}
 
 
-@app.get("/api/alerts/city/{city_name}", summary="Alerts by City")
+@app.get("/api/alerts/city/{city_name}", summary="Alerts by City", response_model=CityAlertsResponse)
 async def get_city_alerts(city_name: str, limit: int = 50):
     """Get alert history for a specific city."""
     limit = max(1, min(100, limit))
@@ -346,14 +495,14 @@ async def get_city_alerts(city_name: str, limit: int = 50):
     return {"city": city_name, "alerts": alerts, "count": len(alerts)}
 
 
-@app.get("/api/alerts/stats", summary="Alert Statistics")
+@app.get("/api/alerts/stats", summary="Alert Statistics", response_model=AlertStatsResponse)
 async def alerts_stats():
     """Get aggregate statistics about stored alerts."""
     stats = await get_alert_stats()
     return stats
 
 
-@app.get("/api/cities", summary="All Known Cities")
+@app.get("/api/cities", summary="All Known Cities", response_model=CitiesResponse)
 async def list_cities():
     """Return all city names with their integer IDs for stable client-side filtering."""
     cities = await get_all_cities()
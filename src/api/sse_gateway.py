@@ -6,17 +6,22 @@ This server provides an SSE endpoint for the VSCode extension to receive alerts.
 It subscribes to the FastAPI webhook and broadcasts alerts to connected VSCode clients.
 """
 import asyncio
-import json
 import logging
 import os
-from typing import Dict, Any, Set
-from datetime import datetime
+import random
+import time
+import zlib
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Any, List, Tuple
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 import httpx
+import orjson
+
+from ..services.sse import aiter_sse_data
 
 # Configure logging
 logging.basicConfig(
@@ -31,8 +36,82 @@ WEBHOOK_URL = os.getenv("WEBHOOK_URL", "http://localhost:8000/api/alerts-stream"
 API_KEY = os.getenv("API_KEY", "dev-secret-key")
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",") if os.getenv("ALLOWED_ORIGINS", "*") != "*" else ["*"]
 
-# Store connected SSE clients for broadcasting
-connected_clients: Set[asyncio.Queue] = set()
+# Gzip member header (no name, mtime 0, unknown OS); the deflate blocks follow per frame
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+def deflate_frame(frame: bytes) -> bytes:
+    """
+    Compresses one SSE frame into self-contained, byte-aligned deflate blocks.
+
+    Each frame uses a fresh compressor and ends with a sync flush, so the
+    result does not depend on earlier frames. Any sequence of them after
+    GZIP_HEADER is a valid gzip stream, which lets one compressed copy of a
+    broadcast frame be shared by every gzip client.
+    """
+    compressor = zlib.compressobj(1, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+# Sent to every client as soon as it connects
+CONNECTION_MESSAGE = b'data: {"type": "connection", "message": "Connected to SSE Gateway"}\n\n'
+# Sent as a data message, not an SSE comment: the VS Code extension's
+# heartbeat timer only resets on messages it receives
+KEEP_ALIVE_MESSAGE = b"data: keep-alive\n\n"
+GZIP_CONNECTION_MESSAGE = GZIP_HEADER + deflate_frame(CONNECTION_MESSAGE)
+GZIP_KEEP_ALIVE_MESSAGE = deflate_frame(KEEP_ALIVE_MESSAGE)
+
+# Alert IDs seen within this many seconds are not broadcast again
+DUPLICATE_WINDOW_SECONDS = 5.0
+# Upper bound on remembered alert IDs
+RECENT_ALERT_IDS_MAX = 1024
+
+# Number of recent broadcast frames kept so a client that wakes late still gets every alert
+BROADCAST_HISTORY = 64
+
+class Broadcaster:
+    """
+    Shares broadcast frames with all connected SSE clients.
+
+    Instead of copying each alert into a queue per client, the frame is
+    stored once under an increasing sequence number and waiting clients are
+    woken with a single notify_all. Each client remembers the last sequence
+    number it sent and picks up everything newer from the recent history.
+    Frames are compressed once on publish for clients that accept gzip.
+    """
+
+    def __init__(self, history: int = BROADCAST_HISTORY):
+        self.seq = 0
+        self.frames: Deque[Tuple[int, bytes, bytes]] = deque(maxlen=history)
+        self.cond = asyncio.Condition()
+        self.client_count = 0
+
+    async def publish(self, frame: bytes):
+        """Stores a frame and wakes every waiting client."""
+        compressed = deflate_frame(frame)
+        async with self.cond:
+            self.seq += 1
+            self.frames.append((self.seq, frame, compressed))
+            self.cond.notify_all()
+
+    async def wait_for_frames(self, last_seq: int, timeout: float, compressed: bool = False) -> Tuple[int, List[bytes]]:
+        """
+        Waits until something newer than last_seq is published.
+
+        Returns the new last sequence number and the frames published since
+        last_seq, as deflate blocks if compressed is set. Raises asyncio.TimeoutError if nothing arrives in time, and
+        ClientLagged if frames the client never saw were already dropped.
+        """
+        async with self.cond:
+            await asyncio.wait_for(self.cond.wait_for(lambda: self.seq != last_seq), timeout)
+            if self.frames and self.frames[0][0] > last_seq + 1:
+                raise ClientLagged(f"{self.frames[0][0] - last_seq - 1} alert(s) missed")
+            index = 2 if compressed else 1
+            return self.seq, [entry[index] for entry in self.frames if entry[0] > last_seq]
+
+class ClientLagged(Exception):
+    """Raised when a client fell so far behind that frames left the history."""
+
+# Shared broadcaster for all connected VSCode extension clients
+broadcaster = Broadcaster()
 
 class AlertSubscriber:
     """SSE client for subscribing to alerts from the FastAPI webhook"""
@@ -43,72 +122,106 @@ class AlertSubscriber:
         self.is_connected = False
         self.subscription_task = None
         self.reconnect_attempts = 0
-        self.max_reconnect_attempts = 50
-        self.reconnect_delay = 5
+        # Exponential backoff with jitter between reconnects; retries never stop
+        self.reconnect_delay = 0.5
+        self.max_reconnect_delay = 30
+        # A connection that stays up this long resets the backoff
+        self.stable_connection_seconds = 30
+        # Alert ID -> monotonic time it was last broadcast, oldest first
+        self.recent_alert_ids: OrderedDict[Any, float] = OrderedDict()
+        # (epoch second, formatted local time) reused for alerts within the same second
+        self.received_at_cache: Tuple[int, str] = (0, "")
+        # One client for the subscriber's lifetime, reused across reconnects
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(None, connect=10.0),
+            http2=True,
+            headers={"X-API-Key": api_key},
+        )
         
+    def next_reconnect_delay(self) -> float:
+        """Backoff delay before the next reconnect attempt"""
+        backoff = self.reconnect_delay * 2 ** min(self.reconnect_attempts, 10)
+        return min(self.max_reconnect_delay, backoff) + random.uniform(0, 0.5)
+
     async def subscribe(self):
-        """Subscribe to SSE webhook and process events"""
-        while self.reconnect_attempts < self.max_reconnect_attempts:
+        """Subscribe to SSE webhook and process events, reconnecting with backoff"""
+        loop = asyncio.get_running_loop()
+        while True:
+            connected_at = None
             try:
                 logger.info(f"🔗 Connecting to SSE webhook: {self.webhook_url}")
-                headers = {"X-API-Key": self.api_key}
-                async with httpx.AsyncClient(timeout=None) as client:
-                    async with client.stream("GET", self.webhook_url, headers=headers) as response:
-                        if response.status_code == 200:
-                            self.is_connected = True
-                            self.reconnect_attempts = 0
-                            logger.info("✅ Successfully connected to SSE webhook")
-                            
-                            async for line in response.aiter_lines():
-                                if line.startswith("data: "):
-                                    try:
-                                        event_data = line[6:]  # Remove "data: " prefix
-                                        
-                                        # Handle keep-alive messages
-                                        if event_data.strip() == "keep-alive":
-                                            continue
-                                            
-                                        # Try to parse as JSON
-                                        alert_data = json.loads(event_data)
-                                        await self.process_alert(alert_data)
-                                        
-                                    except json.JSONDecodeError:
-                                        # Non-JSON data (like keep-alive), skip
-                                        continue
-                                    except Exception as e:
-                                        logger.error(f"Error processing SSE event: {e}")
-                        else:
-                            logger.error(f"SSE connection failed with status {response.status_code}")
-                            self.is_connected = False
-                            break
-                            
+                async with self.client.stream("GET", self.webhook_url) as response:
+                    if response.status_code == 200:
+                        self.is_connected = True
+                        connected_at = loop.time()
+                        logger.info("✅ Successfully connected to SSE webhook")
+                        
+                        async for event_data in aiter_sse_data(response.aiter_bytes()):
+                            # Handle keep-alive messages
+                            if event_data == b"keep-alive":
+                                continue
+                            try:
+                                alert_data = orjson.loads(event_data)
+                                await self.process_alert(alert_data)
+                            except orjson.JSONDecodeError:
+                                # Non-JSON data, skip
+                                continue
+                            except Exception as e:
+                                logger.error(f"Error processing SSE event: {e}")
+                        logger.warning("SSE stream ended")
+                    else:
+                        logger.error(f"SSE connection failed with status {response.status_code}")
+                        
             except Exception as e:
-                self.is_connected = False
-                self.reconnect_attempts += 1
-                logger.error(f"SSE connection error (attempt {self.reconnect_attempts}): {e}")
-                if self.reconnect_attempts < self.max_reconnect_attempts:
-                    delay = min(self.reconnect_delay * self.reconnect_attempts, 60)
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error("Max reconnection attempts reached. SSE client disabled.")
-                    break
+                logger.error(f"SSE connection error (attempt {self.reconnect_attempts + 1}): {e}")
+
+            self.is_connected = False
+            if connected_at is not None and loop.time() - connected_at >= self.stable_connection_seconds:
+                self.reconnect_attempts = 0
+            delay = self.next_reconnect_delay()
+            self.reconnect_attempts += 1
+            logger.info(f"Reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
     
+    def received_at(self) -> str:
+        """Current local time as an ISO 8601 string, formatted at most once per second"""
+        second = int(time.time())
+        if second != self.received_at_cache[0]:
+            self.received_at_cache = (second, time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(second)))
+        return self.received_at_cache[1]
+
     async def process_alert(self, alert_data: Dict[str, Any]):
         """Process incoming alert from SSE stream"""
         if not alert_data or not isinstance(alert_data, dict):
             return
+
+        # Skip alerts the upstream republished moments ago
+        alert_id = alert_data.get("id")
+        if alert_id is not None:
+            now = time.monotonic()
+            seen_at = self.recent_alert_ids.get(alert_id)
+            if seen_at is not None and now - seen_at < DUPLICATE_WINDOW_SECONDS:
+                logger.info(f"Skipping duplicate alert {alert_id}")
+                return
+            self.recent_alert_ids[alert_id] = now
+            self.recent_alert_ids.move_to_end(alert_id)
+            if len(self.recent_alert_ids) > RECENT_ALERT_IDS_MAX:
+                self.recent_alert_ids.popitem(last=False)
             
-        # Add received timestamp and store as the last alert
-        enhanced_alert = {
-            **alert_data,
-            "received_at": datetime.now().isoformat()
-        }
+        # Add received timestamp in place; the dict was freshly parsed for this event
+        alert_data["received_at"] = self.received_at()
         
-        logger.warning(f"🚨 NEW ALERT RECEIVED via SSE: {enhanced_alert.get('id')}")
+        logger.warning(f"🚨 NEW ALERT RECEIVED via SSE: {alert_id}")
         
         # Broadcast to connected VSCode extension clients
-        await broadcast_alert_to_clients(enhanced_alert)
+        await broadcast_alert_to_clients(alert_data)
         
+    async def close(self):
+        """Stop the subscription and release the HTTP client"""
+        if self.subscription_task is not None:
+            self.subscription_task.cancel()
+        await self.client.aclose()
+
     def start_subscription(self):
         """Start the SSE subscription in the background"""
         if self.subscription_task is None or self.subscription_task.done():
@@ -120,53 +233,43 @@ alert_subscriber = AlertSubscriber(WEBHOOK_URL, API_KEY)
 
 async def broadcast_alert_to_clients(alert_data: Dict[str, Any]):
     """Broadcast alert to all connected VSCode extension clients"""
-    global connected_clients
-    
-    if not connected_clients:
+    if not broadcaster.client_count:
         logger.info("No connected clients to broadcast to")
         return
-        
-    disconnected_clients = set()
-    broadcast_data = json.dumps(alert_data)
-    
-    for client_queue in connected_clients:
-        try:
-            await client_queue.put(f"data: {broadcast_data}\n\n")
-        except Exception as e:
-            logger.error(f"Error broadcasting to client: {e}")
-            disconnected_clients.add(client_queue)
-    
-    # Remove disconnected clients
-    connected_clients -= disconnected_clients
-    logger.info(f"Broadcasted alert to {len(connected_clients)} clients")
 
-async def sse_generator(request: Request):
-    """SSE generator for VSCode extension clients"""
-    global connected_clients
-    
-    client_queue = asyncio.Queue()
-    connected_clients.add(client_queue)
-    logger.info(f"New client connected. Total clients: {len(connected_clients)}")
+    await broadcaster.publish(b"data: " + orjson.dumps(alert_data) + b"\n\n")
+    logger.info(f"Broadcasted alert to {broadcaster.client_count} clients")
+
+async def sse_generator(request: Request, gzip: bool = False):
+    """SSE generator for VSCode extension clients, yielding a gzip stream if requested"""
+    last_seq = broadcaster.seq
+    broadcaster.client_count += 1
+    logger.info(f"New client connected. Total clients: {broadcaster.client_count}")
     
     try:
         # Send initial connection message
-        yield "data: {\"type\": \"connection\", \"message\": \"Connected to SSE Gateway\"}\n\n"
+        yield GZIP_CONNECTION_MESSAGE if gzip else CONNECTION_MESSAGE
         
         # Send keep-alive messages and alert data
         while True:
             try:
-                # Wait for data with timeout for keep-alive
-                data = await asyncio.wait_for(client_queue.get(), timeout=30.0)
-                yield data
+                # Wait for new alerts with timeout for keep-alive
+                last_seq, frames = await broadcaster.wait_for_frames(last_seq, timeout=30.0, compressed=gzip)
             except asyncio.TimeoutError:
-                # Send keep-alive message
-                yield "data: keep-alive\n\n"
+                yield GZIP_KEEP_ALIVE_MESSAGE if gzip else KEEP_ALIVE_MESSAGE
+                continue
+            except ClientLagged as e:
+                # Drop the slow client instead of silently skipping alerts; it reconnects
+                logger.warning(f"Disconnecting slow SSE client: {e}")
+                return
+            # Everything published since the last wake-up goes out in a single write
+            yield frames[0] if len(frames) == 1 else b"".join(frames)
                 
     except Exception as e:
         logger.error(f"SSE client disconnected: {e}")
     finally:
-        connected_clients.discard(client_queue)
-        logger.info(f"Client disconnected. Remaining clients: {len(connected_clients)}")
+        broadcaster.client_count -= 1
+        logger.info(f"Client disconnected. Remaining clients: {broadcaster.client_count}")
 
 # Define lifespan handler
 @asynccontextmanager
@@ -176,6 +279,7 @@ async def lifespan(app: FastAPI):
     alert_subscriber.start_subscription()
     yield
     logger.info("🛑 App shutting down")
+    await alert_subscriber.close()
 
 # Create FastAPI app for SSE endpoint  
 app = FastAPI(title="SSE Gateway for VSCode Extension", lifespan=lifespan)
@@ -192,15 +296,21 @@ app.add_middleware(
 @app.get("/api/alerts-stream")
 async def alerts_stream(request: Request):
     """SSE endpoint for VSCode extension"""
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Headers": "*",
+    }
+    gzip = "gzip" in request.headers.get("accept-encoding", "")
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
     return StreamingResponse(
-        sse_generator(request),
+        sse_generator(request, gzip=gzip),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*",
-        }
+        headers=headers,
     )
 
 @app.get("/")
@@ -220,4 +330,5 @@ if __name__ == "__main__":
     logger.info(f"🌐 Listening on port: {port}")
     
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # SSE connections stay open for hours: use the C parser/loop and skip per-request access logs
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools", access_log=False)
\ No newline at end of file
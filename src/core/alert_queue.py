@@ -1,4 +1,49 @@
 import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Any, Iterator, Set
 
-# A simple in-memory queue for passing alerts from the poller to the SSE streamer.
-alert_queue = asyncio.Queue() 
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+# Maximum number of undelivered alerts buffered per SSE subscriber
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class AlertHub:
+    """
+    Fans out alerts from the poller to every connected SSE client.
+
+    Each subscriber gets its own bounded queue. Alerts are published as
+    pre-serialized frames, so delivering one to N clients only copies a
+    reference into N queues. A subscriber that falls too far behind loses its
+    oldest undelivered alerts instead of slowing down everyone else, so the
+    latest alert always gets through. Dropped alerts are counted in `dropped`.
+    """
+
+    def __init__(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.dropped = 0
+
+    @contextmanager
+    def subscribe(self) -> Iterator[asyncio.Queue]:
+        """Registers a new subscriber queue for the duration of the block."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.maxsize)
+        self.subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers.discard(queue)
+
+    def publish(self, alert: Any) -> None:
+        """Delivers an alert to every current subscriber."""
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+                logger.warning(f"SSE subscriber is not keeping up, dropped its oldest alert ({self.dropped} dropped so far).")
+            queue.put_nowait(alert)
+
+
+# The shared hub for passing alerts from the poller to the SSE streams.
+alert_hub = AlertHub()
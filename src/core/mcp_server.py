@@ -8,18 +8,23 @@ by subscribing to the FastAPI webhook service via Server-Sent Events (SSE).
 import asyncio
 import json
 import logging
+import random
 import sys
 import os
-from typing import Dict, Any, Optional, List
-from datetime import datetime, timedelta
+import time
+from typing import Dict, Any, Optional, List, Set, Tuple
+from datetime import datetime
 from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 
 from fastmcp import FastMCP
 import httpx
-from fuzzywuzzy import fuzz, process
+import orjson
+from rapidfuzz import fuzz, process, utils
 
 # Import our existing polling functionality for reference
 from ..services.polling import POHA_API_URL, REQUEST_HEADERS
+from ..services.sse import aiter_sse_data
 from ..db.database import init_db, get_alerts_by_city as db_get_alerts_by_city, get_recent_alerts, get_alert_stats
 
 # Define the history URL here as it's no longer in polling.py
@@ -42,10 +47,47 @@ logger.info(f"API Endpoint: {POHA_API_URL}")
 # Store the last received alert in memory for the resource
 last_alert: Optional[Dict[str, Any]] = None
 
-# Global in-memory cache for alert history
-cached_all_alerts: Optional[List[Dict[str, Any]]] = None
-last_fetch_time: Optional[datetime] = None
-CACHE_DURATION = timedelta(hours=1) # Cache for 1 hour
+# In-memory cache for alert history, keyed by URL: url -> (fetched at, alerts)
+HISTORY_CACHE_TTL_SECONDS = 3600  # Cache for 1 hour
+# Past the TTL, cached history is still served (and refreshed in the background) up to this age
+HISTORY_CACHE_STALE_SECONDS = 2 * HISTORY_CACHE_TTL_SECONDS
+HISTORY_CACHE_MAX_ENTRIES = 8
+_history_cache: Dict[str, Tuple[float, "AlertHistory"]] = {}
+# Background refresh tasks, referenced so they aren't garbage-collected mid-fetch
+_history_refresh_tasks: Set[asyncio.Task] = set()
+# Fetches in progress, keyed by URL, so concurrent cache misses share one request and parse
+_history_inflight: Dict[str, asyncio.Future] = {}
+
+def _history_cache_get(url: str) -> Tuple[Optional["AlertHistory"], bool]:
+    """
+    Returns the cached history for url and whether it is stale.
+
+    The history is None if missing or too old to serve at all.
+    """
+    entry = _history_cache.get(url)
+    if entry is None:
+        return None, False
+    fetched_at, alerts = entry
+    age = time.monotonic() - fetched_at
+    if age >= HISTORY_CACHE_STALE_SECONDS:
+        del _history_cache[url]
+        return None, False
+    return alerts, age >= HISTORY_CACHE_TTL_SECONDS
+
+def _history_cache_set(url: str, alerts: "AlertHistory") -> None:
+    """Caches history for url, evicting the oldest entry when full."""
+    _history_cache.pop(url, None)
+    if len(_history_cache) >= HISTORY_CACHE_MAX_ENTRIES:
+        del _history_cache[next(iter(_history_cache))]
+    _history_cache[url] = (time.monotonic(), alerts)
+
+# Shared client for Pikud Haoref API requests, so history fetches reuse warm connections
+_http = httpx.AsyncClient(
+    timeout=30.0,
+    http2=True,
+    headers=REQUEST_HEADERS,
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+)
 
 # SSE Client Configuration
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "http://localhost:8000/api/webhook/alerts")
@@ -58,55 +100,73 @@ class AlertSubscriber:
         self.webhook_url = webhook_url
         self.api_key = api_key
         self.is_connected = False
+        # Set while the SSE stream is up, so callers can wait for the connection
+        self.connected = asyncio.Event()
         self.subscription_task = None
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 5
+        self.max_reconnect_delay = 60.0
+        # One client for the subscriber's lifetime, reused across reconnects
+        self.client = httpx.AsyncClient(timeout=None, http2=True, headers={"X-API-Key": api_key})
+
+    def _set_connected(self, connected: bool):
+        """Updates the connection flag and event together"""
+        self.is_connected = connected
+        if connected:
+            self.connected.set()
+        else:
+            self.connected.clear()
         
+    def next_reconnect_delay(self) -> float:
+        """Exponential backoff with jitter, so clients don't retry in lockstep"""
+        return min(self.max_reconnect_delay, 2 ** self.reconnect_attempts) + random.uniform(0, 1)
+
+    async def _live_chunks(self, response: httpx.Response):
+        """Yields the stream's bytes, resetting the retry count once data actually flows"""
+        async for chunk in response.aiter_bytes():
+            self.reconnect_attempts = 0
+            yield chunk
+
     async def subscribe(self):
         """Subscribe to SSE webhook and process events"""
         while self.reconnect_attempts < self.max_reconnect_attempts:
             try:
                 logger.info(f"🔗 Connecting to SSE webhook: {self.webhook_url}")
-                headers = {"X-API-Key": self.api_key}
-                async with httpx.AsyncClient(timeout=None) as client:
-                    async with client.stream("GET", self.webhook_url, headers=headers) as response:
-                        if response.status_code == 200:
-                            self.is_connected = True
-                            self.reconnect_attempts = 0
-                            logger.info("✅ Successfully connected to SSE webhook")
+                async with self.client.stream("GET", self.webhook_url) as response:
+                    if response.status_code == 200:
+                        self._set_connected(True)
+                        logger.info("✅ Successfully connected to SSE webhook")
                             
-                            async for line in response.aiter_lines():
-                                if line.startswith("data: "):
-                                    try:
-                                        event_data = line[6:]  # Remove "data: " prefix
-                                        
-                                        # Handle keep-alive messages
-                                        if event_data.strip() == "keep-alive":
-                                            continue
-                                            
-                                        # Try to parse as JSON
-                                        alert_data = json.loads(event_data)
-                                        await self.process_alert(alert_data)
-                                        
-                                    except json.JSONDecodeError:
-                                        # Non-JSON data (like keep-alive), skip
-                                        continue
-                                    except Exception as e:
-                                        logger.error(f"Error processing SSE event: {e}")
-                        else:
-                            logger.error(f"SSE connection failed with status {response.status_code}")
-                            self.is_connected = False
-                            break
+                        # Frame events on raw bytes; only data payloads get decoded
+                        async for event_data in aiter_sse_data(self._live_chunks(response)):
+                            # Handle keep-alive messages
+                            if event_data == b"keep-alive":
+                                continue
+                            try:
+                                alert_data = orjson.loads(event_data)
+                                await self.process_alert(alert_data)
+                            except orjson.JSONDecodeError:
+                                # Non-JSON data, skip
+                                continue
+                            except Exception as e:
+                                logger.error(f"Error processing SSE event: {e}")
+                        logger.warning("SSE stream ended")
+                    else:
+                        logger.error(f"SSE connection failed with status {response.status_code}")
+                        self._set_connected(False)
+                        break
                             
             except Exception as e:
-                self.is_connected = False
-                self.reconnect_attempts += 1
-                logger.error(f"SSE connection error (attempt {self.reconnect_attempts}): {e}")
-                if self.reconnect_attempts < self.max_reconnect_attempts:
-                    await asyncio.sleep(5)  # Wait 5 seconds before reconnecting
-                else:
-                    logger.error("Max reconnection attempts reached. SSE client disabled.")
-                    break
+                logger.error(f"SSE connection error (attempt {self.reconnect_attempts + 1}): {e}")
+
+            self._set_connected(False)
+            self.reconnect_attempts += 1
+            if self.reconnect_attempts >= self.max_reconnect_attempts:
+                logger.error("Max reconnection attempts reached. SSE client disabled.")
+                break
+            delay = self.next_reconnect_delay()
+            logger.info(f"Reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
     
     async def process_alert(self, alert_data: Dict[str, Any]):
         """Process incoming alert from SSE stream"""
@@ -122,7 +182,12 @@ class AlertSubscriber:
         
         logger.warning(f"🚨 NEW ALERT RECEIVED via SSE: {last_alert.get('id')}")
         
-        
+    async def close(self):
+        """Stop the subscription and release the HTTP client"""
+        if self.subscription_task is not None:
+            self.subscription_task.cancel()
+        await self.client.aclose()
+
     def start_subscription(self):
         """Start the SSE subscription in the background"""
         if self.subscription_task is None or self.subscription_task.done():
@@ -133,8 +198,17 @@ class AlertSubscriber:
 alert_subscriber = AlertSubscriber(WEBHOOK_URL, API_KEY)
 
 
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Closes the shared HTTP clients when the server shuts down"""
+    yield
+    logger.info("🛑 MCP server shutting down")
+    await alert_subscriber.close()
+    await _http.aclose()
+
 # Initialize MCP server
 mcp = FastMCP(
+    lifespan=lifespan,
     name="Pikud Haoref Alert System",
     instructions="""
     A comprehensive Model Context Protocol (MCP) server for accessing Israeli emergency alerts
@@ -169,7 +243,12 @@ async def check_current_alerts() -> str:
     
     # Start subscription if not already running
     alert_subscriber.start_subscription()
-    await asyncio.sleep(1) # Give it a moment to connect
+    if not alert_subscriber.is_connected:
+        # Give a fresh subscription up to a second to connect
+        try:
+            await asyncio.wait_for(alert_subscriber.connected.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
     
     # Check connection status FIRST
     if not alert_subscriber.is_connected:
@@ -187,6 +266,169 @@ async def check_current_alerts() -> str:
     
     return alert_text
 
+def _decode_json_stream(text: str) -> List[Any]:
+    """Decodes a stream of concatenated JSON values, allowing whitespace between them."""
+    decoder = json.JSONDecoder()
+    values = []
+    index, end = 0, len(text)
+    while index < end:
+        value, index = decoder.raw_decode(text, index)
+        values.append(value)
+        while index < end and text[index].isspace():
+            index += 1
+    return values
+
+async def _fetch_alert_history(url: str) -> Optional[List[Dict[str, Any]]]:
+    """Fetches and parses the alert history, returning None if it can't be parsed."""
+    logger.info(f"🔗 Making request to: {url}")
+    response = await _http.get(url)
+    response.raise_for_status()
+
+    # The API usually returns a stream of JSON objects rather than a valid array
+    raw_text = await response.aread()
+    # orjson parses UTF-8 bytes directly, so only the BOM and whitespace need stripping
+    json_text = raw_text.removeprefix(b'\xef\xbb\xbf').strip()
+
+    # Response details and previews are only built when debugging
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug(f"📊 Response status: {response.status_code}")
+        logger.debug(f"📊 Response headers: {dict(response.headers)}")
+        logger.debug(f"📊 Raw response size: {len(raw_text)} bytes, stripped: {len(json_text)} bytes")
+        logger.debug(f"📊 Raw response preview (first 500 bytes): {json_text[:500].decode('utf-8', 'replace')}")
+
+    if not json_text:
+        all_alerts = []
+    elif json_text.startswith(b"["):
+        # Already a valid JSON array
+        try:
+            all_alerts = orjson.loads(json_text)
+        except orjson.JSONDecodeError as e:
+            logger.error(f"❌ Failed to parse alert history JSON: {e}")
+            return None
+        logger.info(f"✅ Successfully parsed JSON array - found {len(all_alerts)} alerts")
+    else:
+        # A stream of concatenated objects: wrap the text in brackets to form a valid
+        # JSON array string and replace the object separators.
+        json_array_string = b"[" + json_text.replace(b"}{", b"},{") + b"]"
+        try:
+            all_alerts = orjson.loads(json_array_string)
+            logger.info(f"✅ Successfully parsed transformed JSON - found {len(all_alerts)} alerts")
+        except orjson.JSONDecodeError:
+            # Objects separated by whitespace (or '}{' inside a string) break the splice;
+            # walk the stream object by object instead
+            if debug:
+                logger.debug("📊 Transformed parsing failed, decoding objects one by one...")
+            try:
+                all_alerts = _decode_json_stream(json_text.decode('utf-8', 'replace'))
+            except json.JSONDecodeError as e:
+                logger.error(f"❌ Failed to parse alert history JSON: {e}")
+                logger.error(f"❌ Original text had brackets? Start: '{json_text[:50].decode('utf-8', 'replace')}' End: '{json_text[-50:].decode('utf-8', 'replace')}'")
+                return None
+            logger.info(f"✅ Successfully decoded object stream - found {len(all_alerts)} alerts")
+
+    if debug and isinstance(all_alerts, list):
+        logger.debug(f"📊 Sample alert structure: {all_alerts[0] if all_alerts else 'No alerts'}")
+
+    return all_alerts
+
+@dataclass
+class AlertHistory:
+    """
+    Fetched alert history, normalized once per fetch into parallel arrays.
+
+    Entry i of each list describes the i-th alert, so the filters work on
+    plain strings and indices instead of re-inspecting the alert dicts.
+    """
+    alerts: List[Dict[str, Any]] = field(default_factory=list)
+    # Lowercased str() of each alert's 'data', for region and fuzzy matching
+    data_lower: List[str] = field(default_factory=list)
+    # Areas as shown in the history table
+    data_display: List[str] = field(default_factory=list)
+    alert_dates: List[Any] = field(default_factory=list)
+    # Lowercased city -> indices of alerts whose 'data' list contains it
+    city_index: Dict[str, List[int]] = field(default_factory=dict)
+    # Lowercased 'data' string -> indices of alerts with that string (matched by substring)
+    text_index: Dict[str, List[int]] = field(default_factory=dict)
+
+def _build_alert_history(all_alerts: List[Any]) -> AlertHistory:
+    """Normalizes each alert's areas and date and indexes the alerts by area"""
+    history = AlertHistory()
+    for alert in all_alerts:
+        if not isinstance(alert, dict):
+            logger.warning(f"📊 Skipping history entry that is not a dict: {type(alert)} - {alert}")
+            continue
+        i = len(history.alerts)
+        data = alert.get('data', '')
+        data_lower = str(data).lower()
+        history.alerts.append(alert)
+        history.data_lower.append(data_lower)
+        history.alert_dates.append(alert.get('alertDate', 'N/A'))
+        if isinstance(data, list):
+            history.data_display.append(', '.join(map(str, data)))
+            for city in {str(c).lower() for c in data}:
+                history.city_index.setdefault(city, []).append(i)
+        elif isinstance(data, str):
+            history.data_display.append(data)
+            history.text_index.setdefault(data_lower, []).append(i)
+        else:
+            history.data_display.append('')
+    return history
+
+async def _load_alert_history(url: str) -> Optional[AlertHistory]:
+    """
+    Returns the alert history from the cache, or fetches it.
+
+    Concurrent callers that miss the cache all await the same in-flight
+    fetch instead of each hitting the API. Stale history is returned right
+    away while a background task refreshes it.
+    """
+    all_alerts, stale = _history_cache_get(url)
+    if all_alerts is not None:
+        if stale and url not in _history_inflight:
+            logger.info("📊 Cached alert history is stale, refreshing in the background.")
+            task = asyncio.create_task(_refresh_alert_history(url))
+            _history_refresh_tasks.add(task)
+            task.add_done_callback(_history_refresh_tasks.discard)
+        logger.debug("📊 Using cached alert history.")
+        return all_alerts
+
+    inflight = _history_inflight.get(url)
+    if inflight is not None:
+        logger.info("📊 Waiting for the alert history fetch already in progress.")
+        return await asyncio.shield(inflight)
+
+    logger.info("🔗 Cache expired or not present. Fetching alert history from API.")
+    return await _fetch_shared_alert_history(url)
+
+async def _refresh_alert_history(url: str):
+    """Background refresh of stale history; failures keep serving the stale copy"""
+    try:
+        await _fetch_shared_alert_history(url)
+    except Exception as e:
+        logger.error(f"❌ Background refresh of alert history failed: {e}")
+
+async def _fetch_shared_alert_history(url: str) -> Optional[AlertHistory]:
+    """Fetches history into the cache, sharing the result with callers that arrive meanwhile."""
+    inflight = asyncio.get_running_loop().create_future()
+    _history_inflight[url] = inflight
+    try:
+        all_alerts = await _fetch_alert_history(url)
+        history = _build_alert_history(all_alerts) if all_alerts is not None else None
+        if all_alerts:
+            _history_cache_set(url, history)
+        inflight.set_result(history)
+        return history
+    except asyncio.CancelledError:
+        inflight.cancel()
+        raise
+    except Exception as e:
+        inflight.set_exception(e)
+        inflight.exception()  # Mark as retrieved; waiters (if any) still get it re-raised
+        raise
+    finally:
+        del _history_inflight[url]
+
 @mcp.tool()
 async def get_alert_history(limit: int = 10, region: Optional[str] = None, cities: Optional[List[str]] = None) -> str:
     """
@@ -199,158 +441,89 @@ async def get_alert_history(limit: int = 10, region: Optional[str] = None, citie
     """
     logger.info(f"📋 Getting alert history directly from API (limit: {limit}, region: {region}, cities: {cities})")
     
-    global cached_all_alerts, last_fetch_time
-
     try:
-        # Check cache first
-        if cached_all_alerts and last_fetch_time and (datetime.now() - last_fetch_time) < CACHE_DURATION:
-            logger.info("📊 Using cached alert history.")
-            all_alerts = cached_all_alerts
-        else:
-            logger.info("🔗 Cache expired or not present. Fetching alert history from API.")
-            logger.info(f"🔗 Making request to: {POHA_HISTORY_API_URL}")
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(POHA_HISTORY_API_URL, headers=REQUEST_HEADERS)
-                
-                # Log response details for debugging
-                logger.info(f"📊 Response status: {response.status_code}")
-                logger.info(f"📊 Response headers: {dict(response.headers)}")
-                logger.info(f"📊 Response encoding: {response.encoding}")
-                
-                response.raise_for_status()
-                
-                # The API returns a stream of JSON objects, not a valid array.
-                # We need to manually construct a valid JSON array string.
-                raw_text = await response.aread()
-                logger.info(f"📊 Raw response size: {len(raw_text)} bytes")
-                logger.info(f"📊 Raw response content type: {response.headers.get('content-type', 'unknown')}")
-                
-                decoded_text = raw_text.decode('utf-8-sig')
-                logger.info(f"📊 Decoded text size: {len(decoded_text)} characters")
-                logger.info(f"📊 Raw response preview (first 500 chars): {decoded_text[:500]}")
-                
-                json_text = decoded_text.strip()
-                logger.info(f"📊 Stripped text size: {len(json_text)} characters")
-
-                if not json_text:
-                    all_alerts = []
-                else:
-                    try:
-                        logger.info(f"📊 Attempting to parse JSON directly...")
-                        # Try parsing as-is first (API might return valid JSON array)
-                        all_alerts = json.loads(json_text)
-                        logger.info(f"✅ Successfully parsed JSON directly - found {len(all_alerts)} alerts")
-                        logger.info(f"📊 Sample alert structure: {all_alerts[0] if all_alerts else 'No alerts'}")
-                    except json.JSONDecodeError as e:
-                        logger.info(f"📊 Direct parsing failed, trying transformation...")
-                        logger.info(f"📊 Processing JSON text transformation...")
-                        # Fallback: Wrap the text in brackets to form a valid JSON array string
-                        # and replace the object separators.
-                        json_array_string = f"[{json_text.replace('}{', '},{')}]"
-                        logger.info(f"📊 Transformed JSON array size: {len(json_array_string)} characters")
-                        logger.info(f"📊 Transformed JSON preview (first 500 chars): {json_array_string[:500]}")
-                        
-                        try:
-                            logger.info(f"📊 Attempting to parse transformed JSON...")
-                            all_alerts = json.loads(json_array_string)
-                            logger.info(f"✅ Successfully parsed transformed JSON - found {len(all_alerts)} alerts")
-                            logger.debug(f"📊 All alerts (transformed) type: {type(all_alerts)}, first 3 items: {all_alerts[:3] if isinstance(all_alerts, list) else all_alerts}")
-                            logger.info(f"📊 Sample alert structure: {all_alerts[0] if all_alerts else 'No alerts'}")
-                        except json.JSONDecodeError as e2:
-                            logger.error(f"❌ Failed to parse alert history JSON: {e2}")
-                            logger.error(f"❌ JSON error position: {e2.pos if hasattr(e2, 'pos') else 'unknown'}")
-                            logger.error(f"❌ Problematic JSON string: {json_array_string[:500]}") # Log first 500 chars
-                            logger.error(f"❌ Original text had brackets? Start: '{json_text[:50]}' End: '{json_text[-50:]}'")
-                            return "❌ Error: Could not parse the alert history data from the API."
-            
-            cached_all_alerts = all_alerts
-            last_fetch_time = datetime.now()
+        history = await _load_alert_history(POHA_HISTORY_API_URL)
+        if history is None:
+            return "❌ Error: Could not parse the alert history data from the API."
+        all_alerts = history.alerts
 
         if not all_alerts:
             return "No historical alerts found from the API."
 
         # If cities are specified and limit is default, set limit to max to show all filtered alerts
         if cities and limit == 10:
-            logger.info("📊 Cities filter provided, setting limit to max (50) to show all relevant alerts.")
+            logger.debug("📊 Cities filter provided, setting limit to max (50) to show all relevant alerts.")
             limit = 50 # Set to max allowed by the API to retrieve all filtered results
 
         # Validate limit
         limit = max(1, min(50, limit))
         
-        final_filtered_alerts = all_alerts
+        # Normalize the requested filters once per call
+        region_lower = region.lower() if region else None
+        cities_lower = [c.lower() for c in cities] if cities else []
+        cities_lower_set = set(cities_lower)
+        filter_by_city = bool(cities) and "all" not in cities_lower_set
         
+        # The region filter is applied once; both city passes work on this subset
+        data_lower = history.data_lower
+        region_indices = range(len(all_alerts))
         if region:
-            valid_alerts_by_region = []
-            for alert in all_alerts:
-                if isinstance(alert, dict):
-                    if region.lower() in str(alert.get('data', '')).lower():
-                        valid_alerts_by_region.append(alert)
-            final_filtered_alerts = valid_alerts_by_region
+            region_indices = [i for i, text in enumerate(data_lower) if region_lower in text]
+        final_indices = region_indices
 
         # --- First Pass: Exact City Matching ---
         exact_match_found = False
-        if cities and not ("all" in [c.lower() for c in cities]):
-            logger.info(f"📊 Applying exact city filter for cities: {cities}")
-            exact_city_filtered_alerts = []
-            for alert in final_filtered_alerts:
-                if isinstance(alert, dict):
-                    alert_data_str = str(alert.get('data', '')).lower()
-                    if isinstance(alert.get('data'), list):
-                        # For list of cities, check if any exact city matches
-                        if any(c.lower() in [city.lower() for city in cities] for c in alert.get('data')):
-                            exact_city_filtered_alerts.append(alert)
-                    elif isinstance(alert.get('data'), str):
-                        # For single city string, check if any city is contained in the alert data
-                        if any(city.lower() in alert_data_str for city in cities):
-                            exact_city_filtered_alerts.append(alert)
-            final_filtered_alerts = exact_city_filtered_alerts
-            if final_filtered_alerts: # If exact matches found, set flag
+        if filter_by_city:
+            logger.debug(f"📊 Applying exact city filter for cities: {cities}")
+            matched_indices = set()
+            # For list of cities, check if any exact city matches
+            for city in cities_lower_set:
+                matched_indices.update(history.city_index.get(city, ()))
+            # For single city string, check if any city is contained in the alert data;
+            # each distinct string is checked once, however many alerts share it
+            for alert_data_str, indices in history.text_index.items():
+                if any(city in alert_data_str for city in cities_lower):
+                    matched_indices.update(indices)
+            # Indices follow the API order; intersecting keeps any region filter
+            if region:
+                matched_indices.intersection_update(region_indices)
+            final_indices = sorted(matched_indices)
+            if final_indices: # If exact matches found, set flag
                 exact_match_found = True
         
         # --- Second Pass: Fuzzy City Matching (if no exact matches and cities were provided) ---
-        if cities and not exact_match_found and not ("all" in [c.lower() for c in cities]):
-            logger.info(f"📊 No exact matches found. Trying fuzzy city filter for cities: {cities}")
-            fuzzy_city_filtered_alerts = []
+        if filter_by_city and not exact_match_found:
+            logger.debug(f"📊 No exact matches found. Trying fuzzy city filter for cities: {cities}")
             FUZZY_THRESHOLD = 60 # Lowered for better matching
-            matched_cities = set()  # Track which cities we actually matched
-
-            for alert in all_alerts: # Re-filter from all_alerts to ensure fuzzy doesn't miss anything due to prior exact filtering
-                if isinstance(alert, dict):
-                    alert_data_str = str(alert.get('data', ''))
-                    
-                    # Check fuzzy match for each requested city against alert data
-                    is_fuzzy_match = False
-                    for city_name in cities:
-                        fuzzy_score = fuzz.partial_ratio(city_name.lower(), alert_data_str.lower())
-                        if fuzzy_score >= FUZZY_THRESHOLD:
-                            is_fuzzy_match = True
-                            matched_cities.add(city_name)
-                            logger.debug(f"📊 Fuzzy match: '{city_name}' -> '{alert_data_str}' (score: {fuzzy_score})")
-                            break
-                    
-                    if is_fuzzy_match:
-                        fuzzy_city_filtered_alerts.append(alert)
-            
-            final_filtered_alerts = fuzzy_city_filtered_alerts
-            logger.info(f"📊 Fuzzy matching found {len(fuzzy_city_filtered_alerts)} alerts for cities: {list(matched_cities)}")
+
+            # Start again from the region subset (not the empty exact result), so only alerts
+            # in the region get scored
+            # Every (city, alert) pair is scored in one native call; default_process lowercases both
+            # sides once, and pairs below the cutoff score 0.
+            scores = process.cdist(
+                cities,
+                [data_lower[i] for i in region_indices],
+                scorer=fuzz.partial_ratio,
+                processor=utils.default_process,
+                score_cutoff=FUZZY_THRESHOLD,
+                workers=-1,
+            )
+            is_fuzzy_match = scores.max(axis=0) >= FUZZY_THRESHOLD
+            fuzzy_indices = [i for i, matched in zip(region_indices, is_fuzzy_match) if matched]
+            # Track which cities we actually matched (the best-scoring one per alert)
+            matched_cities = {cities[i] for i in scores.argmax(axis=0)[is_fuzzy_match]}
             
-            if region:
-                # Reapply region filter after fuzzy match if region was specified
-                region_re_filtered_alerts = []
-                for alert in final_filtered_alerts:
-                    if isinstance(alert, dict):
-                        if region.lower() in str(alert.get('data', '')).lower():
-                            region_re_filtered_alerts.append(alert)
-                final_filtered_alerts = region_re_filtered_alerts
+            final_indices = fuzzy_indices
+            logger.info(f"📊 Fuzzy matching found {len(fuzzy_indices)} alerts for cities: {list(matched_cities)}")
         else:
             matched_cities = set()  # Initialize for non-fuzzy cases
             
-        limited_alerts = final_filtered_alerts[:limit]
+        limited_indices = final_indices[:limit]
         
-        if not limited_alerts:
+        if not limited_indices:
             filter_text = f" matching region '{region}'" if region else ""
             city_filter_status = "" # Default to empty
-            if cities and not ("all" in [c.lower() for c in cities]):
+            if filter_by_city:
                 if exact_match_found: # Should not happen if not limited alerts, but for safety
                     city_filter_status = f" (exact match for {cities})"
                 elif not exact_match_found and cities:
@@ -364,7 +537,7 @@ async def get_alert_history(limit: int = 10, region: Optional[str] = None, citie
         
         # Add filter info to the header
         filter_info = ""
-        if cities and not ("all" in [c.lower() for c in cities]):
+        if filter_by_city:
             if exact_match_found:
                 filter_info = f" (exact match for {cities})"
             elif matched_cities:
@@ -372,33 +545,19 @@ async def get_alert_history(limit: int = 10, region: Optional[str] = None, citie
         if region:
             filter_info += f" in region '{region}'"
             
-        history_text = f"📋 **Recent Alert History from API**{filter_info} (showing {len(limited_alerts)} alerts)\n\n"
-        history_text += "| Areas | Alert Time |\n"
-        history_text += "|---|---|\n"
+        # Collect lines and join once at the end
+        history_lines = [
+            f"📋 **Recent Alert History from API**{filter_info} (showing {len(limited_indices)} alerts)\n\n",
+            "| Areas | Alert Time |\n",
+            "|---|---|\n",
+        ]
         
-        for i, alert in enumerate(limited_alerts, 1):
-            logger.debug(f"📊 Processing alert {i}. Type: {type(alert)}, Content: {alert}")
-            # Ensure alert is a dictionary
-            if not isinstance(alert, dict):
-                logger.warning(f"📊 Alert {i} is not a dict: {type(alert)} - {alert}")
-                continue
-                
-            # History API has a different structure for city data
-            city_data = alert.get('data', '')
-            if isinstance(city_data, str):
-                cities = [city_data] if city_data else []
-            elif isinstance(city_data, list):
-                cities = city_data
-            else:
-                cities = []
-
-            areas_str = ', '.join(cities)
-            alert_time_str = alert.get('alertDate', 'N/A')
-            
-            history_text += f"| {areas_str} | {alert_time_str} |\n"
+        history_lines.extend(
+            f"| {history.data_display[i]} | {history.alert_dates[i]} |\n" for i in limited_indices
+        )
         
-        logger.info(f"📋 Returned {len(limited_alerts)} alerts from history API")
-        return history_text
+        logger.info(f"📋 Returned {len(limited_indices)} alerts from history API")
+        return "".join(history_lines)
         
     except httpx.RequestError as e:
         logger.error(f"❌ Error fetching alert history from API: {e}")
@@ -419,20 +578,22 @@ async def get_connection_status() -> str:
     # Ensure subscription is active to report on it
     alert_subscriber.start_subscription()
     
-    status_text = "📊 **SSE Subscription Status**\n\n"
-    status_text += f"**Connection Status:** {'✅ Connected' if alert_subscriber.is_connected else '❌ Disconnected'}\n"
-    status_text += f"**Webhook URL:** {alert_subscriber.webhook_url}\n"
-    status_text += f"**Reconnection Attempts:** {alert_subscriber.reconnect_attempts}/{alert_subscriber.max_reconnect_attempts}\n"
+    status_lines = [
+        "📊 **SSE Subscription Status**\n\n",
+        f"**Connection Status:** {'✅ Connected' if alert_subscriber.is_connected else '❌ Disconnected'}\n",
+        f"**Webhook URL:** {alert_subscriber.webhook_url}\n",
+        f"**Reconnection Attempts:** {alert_subscriber.reconnect_attempts}/{alert_subscriber.max_reconnect_attempts}\n",
+    ]
     
     if last_alert:
-        status_text += f"**Last Alert Received:** {last_alert.get('received_at', 'N/A')}\n"
-        status_text += f"**Last Alert ID:** {last_alert.get('id', 'N/A')}\n"
+        status_lines.append(f"**Last Alert Received:** {last_alert.get('received_at', 'N/A')}\n")
+        status_lines.append(f"**Last Alert ID:** {last_alert.get('id', 'N/A')}\n")
     else:
-        status_text += f"**Last Alert Received:** No alerts received yet\n"
+        status_lines.append("**Last Alert Received:** No alerts received yet\n")
     
-    status_text += f"**Check Time:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+    status_lines.append(f"**Check Time:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
     
-    return status_text
+    return "".join(status_lines)
 
 @mcp.resource("poha://alerts/current-status")
 async def get_current_status() -> str:
@@ -471,12 +632,11 @@ async def get_city_alerts(city: str, limit: int = 20) -> str:
     if not alerts:
         return f"No alerts found for city: {city}"
 
-    text = f"📋 **Alert History for {city}** (showing {len(alerts)} alerts)\n\n"
-    text += "| Areas | Time |\n|---|---|\n"
+    lines = [f"📋 **Alert History for {city}** (showing {len(alerts)} alerts)\n\n", "| Areas | Time |\n|---|---|\n"]
     for a in alerts:
         areas = ", ".join(a.get("data", []))
-        text += f"| {areas} | {a.get('timestamp', 'N/A')} |\n"
-    return text
+        lines.append(f"| {areas} | {a.get('timestamp', 'N/A')} |\n")
+    return "".join(lines)
 
 
 @mcp.tool()
@@ -490,17 +650,20 @@ async def get_db_stats() -> str:
         logger.error(f"Error querying stats: {e}")
         return f"❌ Error: {e}"
 
-    text = f"📊 **Alert Database Statistics**\n\n"
-    text += f"**Total Alerts:** {stats['total_alerts']}\n"
-    text += f"**Total City Entries:** {stats['total_city_entries']}\n\n"
+    lines = [
+        "📊 **Alert Database Statistics**\n\n",
+        f"**Total Alerts:** {stats['total_alerts']}\n",
+        f"**Total City Entries:** {stats['total_city_entries']}\n\n",
+    ]
     if stats["top_cities"]:
-        text += "**Top Cities:**\n"
-        for c in stats["top_cities"]:
-            text += f"- {c['city']}: {c['count']} alerts\n"
-    return text
+        lines.append("**Top Cities:**\n")
+        lines.extend(f"- {c['city']}: {c['count']} alerts\n" for c in stats["top_cities"])
+    return "".join(lines)
 
 
 
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
@@ -509,10 +672,38 @@ async def health(request: Request) -> JSONResponse:
     return JSONResponse({"status": "ok", "service": "mcp-tools"})
 
 
+class SSENoBufferingMiddleware:
+    """Marks text/event-stream responses as unbuffered, so reverse proxies (nginx) pass events straight through"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = message.setdefault("headers", [])
+                content_type = next((v for k, v in headers if k.lower() == b"content-type"), b"")
+                if content_type.startswith(b"text/event-stream"):
+                    headers.append((b"x-accel-buffering", b"no"))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# GZip compresses larger JSON responses; Starlette leaves text/event-stream uncompressed
+HTTP_MIDDLEWARE = [
+    Middleware(SSENoBufferingMiddleware),
+    Middleware(GZipMiddleware, minimum_size=512),
+]
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", os.getenv("MCP_PORT", "8001")))
     logger.info("🚀 Starting Pikud Haoref Alert MCP Server (HTTP Transport)")
     logger.info(f"🔗 Will connect to SSE webhook: {WEBHOOK_URL}")
     logger.info(f"🌐 Listening on port: {port}")
 
-    mcp.run(transport="streamable-http", host="0.0.0.0", port=port)
\ No newline at end of file
+    mcp.run(transport="streamable-http", host="0.0.0.0", port=port, middleware=HTTP_MIDDLEWARE)
\ No newline at end of file
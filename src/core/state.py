@@ -1,14 +1,54 @@
 import asyncio
-from dataclasses import dataclass
-from typing import Optional
-
-# A queue to broadcast new alerts to all connected clients
-alert_queue: asyncio.Queue = asyncio.Queue()
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Optional, Tuple
 
 @dataclass
 class AppState:
     """A simple class to hold the application's shared state."""
     last_alert_id: Optional[str] = None
+    # Set to wake the poller immediately instead of waiting for its next interval
+    alert_hint: asyncio.Event = field(default_factory=asyncio.Event)
 
 # A single, shared instance of the application state
 app_state = AppState()
+
+# Identical alerts (same category and cities) seen within this window are not broadcast again.
+# Upstream and fake alerts are tracked separately, so a test alert never suppresses a real one.
+DUPLICATE_WINDOW_SECONDS = 5
+# How long an alert is remembered for duplicate detection
+DUPLICATE_MEMORY_SECONDS = 30
+
+# (source, category, sorted cities) -> time last seen, oldest first
+_recent_alerts: "OrderedDict[Tuple[str, str, Tuple[str, ...]], float]" = OrderedDict()
+
+def _alert_key(cat: Any, cities: Iterable[str], source: str) -> Tuple[str, str, Tuple[str, ...]]:
+    """Identifies an alert by where it came from, its category and its cities, in any order."""
+    return (source, str(cat), tuple(sorted(cities)))
+
+def is_duplicate_alert(cat: Any, cities: Iterable[str], source: str = "upstream") -> bool:
+    """
+    Returns True if an identical alert from the same source ("upstream" for the
+    poller, "fake" for test alerts) was already seen in the last
+    DUPLICATE_WINDOW_SECONDS; otherwise records this one and returns False.
+    """
+    now = time.monotonic()
+    # Forget alerts older than the memory window
+    while _recent_alerts:
+        oldest_key, seen_at = next(iter(_recent_alerts.items()))
+        if now - seen_at < DUPLICATE_MEMORY_SECONDS:
+            break
+        del _recent_alerts[oldest_key]
+
+    key = _alert_key(cat, cities, source)
+    seen_at = _recent_alerts.get(key)
+    if seen_at is not None and now - seen_at < DUPLICATE_WINDOW_SECONDS:
+        return True
+    _recent_alerts[key] = now
+    _recent_alerts.move_to_end(key)
+    return False
+
+def forget_alert(cat: Any, cities: Iterable[str], source: str = "upstream") -> None:
+    """Removes an alert recorded by is_duplicate_alert, e.g. when it couldn't be sent after all."""
+    _recent_alerts.pop(_alert_key(cat, cities, source), None)
@@ -1,8 +1,14 @@
 import os
-import json
+import asyncio
 import logging
+import sqlite3
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from functools import wraps
+from typing import List, Dict, Any, Optional, Tuple
+
+import orjson
 
 try:
     import aiosqlite
@@ -13,21 +19,120 @@ logger = logging.getLogger(__name__)
 
 DATABASE_PATH = os.getenv("DATABASE_PATH", "data/alerts.db")
 
+# Writer connection; reads go through a small pool of read-only connections, which
+# WAL lets run alongside the writer
 _db: Optional[aiosqlite.Connection] = None
+DATABASE_READERS = int(os.getenv("DATABASE_READERS", "4"))
+_readers: Optional[asyncio.Queue] = None
+_reader_conns: List[aiosqlite.Connection] = []
+# Serializes transactions on the shared writer: the poller, the persist worker and the
+# history sync all save concurrently, and a second BEGIN inside an open one fails
+_write_lock: Optional[asyncio.Lock] = None
+_init_lock = asyncio.Lock()
 
 # In-memory cache: city name -> integer ID (avoids DB round-trip on every insert)
 _city_cache: Dict[str, int] = {}
 
+# Short-lived cache of read query results, so monitors polling the history/stats
+# endpoints collapse to one DB read per TTL. Cleared whenever alerts are written.
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "2"))
+QUERY_CACHE_MAX_ENTRIES = 256
+_query_cache: Dict[tuple, Tuple[float, Any]] = {}
+
+
+def _cached_query(func):
+    """Cache an async read query's result per (function, arguments) for QUERY_CACHE_TTL_SECONDS."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        hit = _query_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+        result = await func(*args, **kwargs)
+        # Results from an uninitialized DB are placeholders and must not be cached
+        if _db and QUERY_CACHE_TTL_SECONDS > 0:
+            if len(_query_cache) >= QUERY_CACHE_MAX_ENTRIES:
+                _query_cache.pop(next(iter(_query_cache)))
+            _query_cache[key] = (now + QUERY_CACHE_TTL_SECONDS, result)
+        return result
+    return wrapper
+
+
+async def _connect(read_only: bool = False) -> aiosqlite.Connection:
+    """Open a connection with the per-connection pragmas applied."""
+    # A larger statement cache keeps every query this module issues prepared
+    conn = await aiosqlite.connect(DATABASE_PATH, cached_statements=256)
+    conn.row_factory = aiosqlite.Row
+    if read_only:
+        await conn.execute("PRAGMA query_only=ON")
+    await conn.execute("PRAGMA temp_store=MEMORY")
+    await conn.execute("PRAGMA mmap_size=134217728")
+    await conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+    return conn
+
+
+@asynccontextmanager
+async def _reader():
+    """Borrow a read-only connection from the pool."""
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
 
 async def init_db():
-    """Initialize database connection and create tables."""
-    global _db
-    os.makedirs(os.path.dirname(DATABASE_PATH) or ".", exist_ok=True)
-    _db = await aiosqlite.connect(DATABASE_PATH)
-    _db.row_factory = aiosqlite.Row
-    await _db.execute("PRAGMA journal_mode=WAL")
-    await _db.execute("PRAGMA foreign_keys=ON")
-    await _db.executescript("""
+    """Initialize database connections and create tables. Does nothing if already initialized."""
+    global _db, _readers, _write_lock
+    if _db:
+        return
+    # Concurrent first calls (every MCP tool call runs init_db) wait here, and the
+    # connections are published only once the reader pool is ready
+    async with _init_lock:
+        if _db:
+            return
+        os.makedirs(os.path.dirname(DATABASE_PATH) or ".", exist_ok=True)
+        db = await _connect()
+        readers: List[aiosqlite.Connection] = []
+        try:
+            await _create_schema(db)
+            # Pre-load city cache from DB
+            cursor = await db.execute("SELECT id, name FROM cities")
+            rows = await cursor.fetchall()
+            _city_cache.clear()
+            _query_cache.clear()
+            for row in rows:
+                _city_cache[row["name"]] = row["id"]
+            await _backfill_normalized_json(db)
+
+            # Readers are opened after the schema exists, so they see it
+            for _ in range(max(1, DATABASE_READERS)):
+                readers.append(await _connect(read_only=True))
+        except BaseException:
+            for conn in (*readers, db):
+                await conn.close()
+            raise
+
+        _reader_conns.extend(readers)
+        _readers = asyncio.Queue()
+        for conn in readers:
+            _readers.put_nowait(conn)
+        _write_lock = asyncio.Lock()
+        _db = db
+    logger.info(f"Database initialized at {DATABASE_PATH} ({len(_city_cache)} cities cached)")
+
+
+async def _create_schema(db: aiosqlite.Connection):
+    """Set the connection pragmas and create or migrate the tables and indexes."""
+    # Only takes effect on a new database (before the first table exists); WAL databases
+    # keep the page size they were created with
+    await db.execute("PRAGMA page_size=8192")
+    await db.execute("PRAGMA journal_mode=WAL")
+    # WAL makes NORMAL durable across app crashes; only an OS crash can lose the last commits
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA foreign_keys=ON")
+    await db.executescript("""
         CREATE TABLE IF NOT EXISTS alerts (
             id TEXT PRIMARY KEY,
             title TEXT,
@@ -35,7 +140,8 @@ async def init_db():
             description TEXT,
             data_json TEXT,
             raw_json TEXT,
-            timestamp TEXT NOT NULL
+            timestamp TEXT NOT NULL,
+            normalized_json BLOB
         );
         CREATE TABLE IF NOT EXISTS cities (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -48,87 +154,194 @@ async def init_db():
             timestamp TEXT NOT NULL,
             UNIQUE(alert_id, city_id)
         );
-        CREATE INDEX IF NOT EXISTS idx_city_alerts_city_id ON city_alerts(city_id);
+        DROP INDEX IF EXISTS idx_city_alerts_city_id;
+        DROP INDEX IF EXISTS idx_city_alerts_city_ts;
+        -- Covers the per-city lookup: newest-first range scan with the alert IDs, no sort
+        CREATE INDEX IF NOT EXISTS idx_city_alerts_city_ts_alert ON city_alerts(city_id, timestamp DESC, alert_id);
         CREATE INDEX IF NOT EXISTS idx_city_alerts_timestamp ON city_alerts(timestamp);
-        CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp);
+        -- Indexing normalized_json too would copy every JSON blob into the index
+        DROP INDEX IF EXISTS idx_alerts_recent;
     """)
-    await _db.commit()
+    cursor = await db.execute("PRAGMA table_info(alerts)")
+    if "normalized_json" not in {row["name"] for row in await cursor.fetchall()}:
+        await db.execute("ALTER TABLE alerts ADD COLUMN normalized_json BLOB")
+    # Recent alerts are read newest-first from this index, then fetched by rowid; only the
+    # LIMIT rows visit the table
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp)")
+    await db.commit()
+
 
-    # Pre-load city cache from DB
-    cursor = await _db.execute("SELECT id, name FROM cities")
+async def _backfill_normalized_json(db: aiosqlite.Connection):
+    """Store the read-side JSON for alerts saved before the normalized_json column existed."""
+    cursor = await db.execute(
+        "SELECT id, title, category, description, data_json, raw_json, timestamp "
+        "FROM alerts WHERE normalized_json IS NULL"
+    )
     rows = await cursor.fetchall()
-    _city_cache.clear()
-    for row in rows:
-        _city_cache[row["name"]] = row["id"]
-    logger.info(f"Database initialized at {DATABASE_PATH} ({len(_city_cache)} cities cached)")
+    if not rows:
+        return
+    await db.executemany(
+        "UPDATE alerts SET normalized_json = ? WHERE id = ?",
+        [(orjson.dumps(_normalize_alert_row(r)), r["id"]) for r in rows],
+    )
+    await db.commit()
+    logger.info(f"Backfilled normalized JSON for {len(rows)} alerts")
+
+
+async def optimize_db():
+    """Let SQLite refresh the query planner statistics it considers stale."""
+    if _db:
+        async with _write_lock:
+            await _db.execute("PRAGMA optimize")
 
 
 async def close_db():
-    """Close database connection."""
-    global _db
+    """Close database connections."""
+    global _db, _readers
+    for conn in _reader_conns:
+        await conn.close()
+    _reader_conns.clear()
+    _readers = None
     if _db:
+        await optimize_db()
         await _db.close()
         _db = None
     _city_cache.clear()
+    _query_cache.clear()
+
 
+# City names per statement, well below SQLite's bound-parameter limit
+CITY_LOOKUP_CHUNK = 500
 
-async def _get_city_id(city_name: str) -> int:
-    """Resolve a city name to its integer ID, inserting if new. Uses in-memory cache."""
-    if city_name in _city_cache:
-        return _city_cache[city_name]
-    # Not in cache — insert or fetch from DB
-    await _db.execute("INSERT OR IGNORE INTO cities (name) VALUES (?)", (city_name,))
-    cursor = await _db.execute("SELECT id FROM cities WHERE name = ?", (city_name,))
-    row = await cursor.fetchone()
-    city_id = row["id"]
-    _city_cache[city_name] = city_id
+
+# Multi-row UPSERT ... RETURNING needs SQLite 3.35+
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+async def _cache_city_ids(city_names: List[str]):
+    """Make sure every city name has a cached ID, creating the missing cities in one batch."""
+    unknown = list(dict.fromkeys(c for c in city_names if c not in _city_cache))
+    if not unknown:
+        return
+    if not _HAS_RETURNING:
+        await _db.executemany("INSERT OR IGNORE INTO cities (name) VALUES (?)", [(c,) for c in unknown])
+    for i in range(0, len(unknown), CITY_LOOKUP_CHUNK):
+        chunk = unknown[i:i + CITY_LOOKUP_CHUNK]
+        if _HAS_RETURNING:
+            # Inserts new names and returns the IDs of new and existing ones in a single statement;
+            # the no-op update is what makes RETURNING include rows that already existed
+            cursor = await _db.execute(
+                f"INSERT INTO cities (name) VALUES {', '.join(['(?)'] * len(chunk))} "
+                "ON CONFLICT(name) DO UPDATE SET name = excluded.name RETURNING id, name",
+                chunk,
+            )
+        else:
+            cursor = await _db.execute(
+                f"SELECT id, name FROM cities WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+            )
+        for row in await cursor.fetchall():
+            _city_cache[row["name"]] = row["id"]
+
+
+async def _lookup_city_id(city: str) -> Optional[int]:
+    """
+    Return a city's ID, or None if the city isn't in the database.
+
+    init_db loads the cache only once per process, and other processes (the poller, when
+    this is the MCP server) keep adding cities, so a cache miss is checked against the DB.
+    """
+    city_id = _city_cache.get(city)
+    if city_id is None:
+        async with _reader() as conn:
+            cursor = await conn.execute("SELECT id FROM cities WHERE name = ?", (city,))
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        city_id = _city_cache[city] = row["id"]
     return city_id
 
 
 async def save_alert(alert: Dict[str, Any]):
     """Save an alert and its per-city entries."""
+    await save_alerts([alert])
+
+
+async def save_alerts(alerts: List[Dict[str, Any]]):
+    """Save a batch of alerts and their per-city entries in a single transaction."""
     if not _db:
         logger.warning("Database not initialized, skipping save")
         return
 
-    timestamp = alert.get("timestamp") or datetime.now().isoformat()
-    cities = alert.get("cities") or alert.get("data", [])
-    if isinstance(cities, str):
-        cities = [cities]
-
-    await _db.execute(
-        "INSERT OR IGNORE INTO alerts (id, title, category, description, data_json, raw_json, timestamp) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (
-            alert.get("id"),
-            alert.get("title"),
-            alert.get("category") or alert.get("cat"),
-            alert.get("desc"),
-            json.dumps(cities, ensure_ascii=False),
-            json.dumps(alert, ensure_ascii=False),
-            timestamp,
-        ),
-    )
+    async with _write_lock:
+        # One explicit transaction covers the new cities and both batched inserts
+        await _db.execute("BEGIN")
+        # City IDs cached by this batch are the newest entries; they're dropped again if it rolls back
+        cached_cities = len(_city_cache)
+        try:
+            prepared = []
+            for alert in alerts:
+                timestamp = alert.get("timestamp") or datetime.now().isoformat()
+                cities = alert.get("cities") or alert.get("data", [])
+                if isinstance(cities, str):
+                    cities = [cities]
+                prepared.append((alert, cities, timestamp))
+            # Resolve the whole batch's new cities up front instead of one lookup per city
+            await _cache_city_ids([city for _, cities, _ in prepared for city in cities])
 
-    for city in cities:
-        city_id = await _get_city_id(city)
-        await _db.execute(
-            "INSERT OR IGNORE INTO city_alerts (alert_id, city_id, timestamp) VALUES (?, ?, ?)",
-            (alert.get("id"), city_id, timestamp),
-        )
+            alert_rows = []
+            city_rows = []
+            for alert, cities, timestamp in prepared:
+                for city in cities:
+                    city_rows.append((alert.get("id"), _city_cache[city], timestamp))
 
-    await _db.commit()
+                category = alert.get("category") or alert.get("cat")
+                row = {
+                    "id": alert.get("id"),
+                    "title": alert.get("title"),
+                    # Stored as TEXT either way; converting here keeps normalized_json identical to a read
+                    "category": str(category) if category is not None else None,
+                    "description": alert.get("desc"),
+                    "data_json": orjson.dumps(cities).decode(),
+                    "raw_json": orjson.dumps(alert).decode(),
+                    "timestamp": timestamp,
+                }
+                # Reads return this as-is instead of rebuilding it from the other columns every time
+                normalized = orjson.dumps(_normalize_alert_row(row, raw=alert))
+                alert_rows.append((*row.values(), normalized))
 
+            await _db.executemany(
+                "INSERT OR IGNORE INTO alerts "
+                "(id, title, category, description, data_json, raw_json, timestamp, normalized_json) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                alert_rows,
+            )
+            await _db.executemany(
+                "INSERT OR IGNORE INTO city_alerts (alert_id, city_id, timestamp) VALUES (?, ?, ?)",
+                city_rows,
+            )
+            await _db.commit()
+        except BaseException:
+            await _db.rollback()
+            for name in list(_city_cache)[cached_cities:]:
+                del _city_cache[name]
+            raise
+    _query_cache.clear()
 
-def _normalize_alert_row(r) -> Dict[str, Any]:
-    """Build a normalized alert dict from a DB row, falling back to raw_json for missing fields."""
-    raw = {}
-    if r["raw_json"]:
-        try:
-            raw = json.loads(r["raw_json"])
-        except json.JSONDecodeError:
-            pass
-    cities = json.loads(r["data_json"]) if r["data_json"] else raw.get("cities") or raw.get("data") or []
+
+def _normalize_alert_row(r, raw: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Build a normalized alert dict from a DB row, falling back to raw_json for missing fields.
+
+    Pass the original alert as raw to skip parsing raw_json.
+    """
+    if raw is None:
+        raw = {}
+        if r["raw_json"]:
+            try:
+                raw = orjson.loads(r["raw_json"])
+            except orjson.JSONDecodeError:
+                pass
+    cities = orjson.loads(r["data_json"]) if r["data_json"] else raw.get("cities") or raw.get("data") or []
     return {
         "id": r["id"],
         "title": r["title"] or raw.get("title") or raw.get("instructions", ""),
@@ -141,69 +354,76 @@ def _normalize_alert_row(r) -> Dict[str, Any]:
     }
 
 
+@_cached_query
 async def get_alerts_by_city(city: str, limit: int = 50) -> List[Dict[str, Any]]:
     """Get alerts for a specific city."""
     if not _db:
         return []
     limit = min(limit, 100)
     # Resolve city name to ID; if city not in DB, no results
-    city_id = _city_cache.get(city)
+    city_id = await _lookup_city_id(city)
     if city_id is None:
         return []
-    cursor = await _db.execute(
-        "SELECT a.id, a.title, a.category, a.description, a.data_json, a.raw_json, a.timestamp "
-        "FROM city_alerts ca JOIN alerts a ON ca.alert_id = a.id "
-        "WHERE ca.city_id = ? ORDER BY a.timestamp DESC LIMIT ?",
-        (city_id, limit),
-    )
-    rows = await cursor.fetchall()
-    return [_normalize_alert_row(r) for r in rows]
+    async with _reader() as conn:
+        cursor = await conn.execute(
+            "SELECT a.normalized_json "
+            "FROM city_alerts ca JOIN alerts a ON ca.alert_id = a.id "
+            "WHERE ca.city_id = ? ORDER BY ca.timestamp DESC LIMIT ?",
+            (city_id, limit),
+        )
+        rows = await cursor.fetchall()
+    return [orjson.loads(r["normalized_json"]) for r in rows]
 
 
+@_cached_query
 async def get_recent_alerts(limit: int = 50, since: Optional[str] = None) -> List[Dict[str, Any]]:
     """Get recent alerts, optionally filtered by timestamp."""
     if not _db:
         return []
     limit = min(limit, 100)
-    if since:
-        cursor = await _db.execute(
-            "SELECT id, title, category, description, data_json, raw_json, timestamp "
-            "FROM alerts WHERE timestamp >= ? ORDER BY timestamp DESC LIMIT ?",
-            (since, limit),
-        )
-    else:
-        cursor = await _db.execute(
-            "SELECT id, title, category, description, data_json, raw_json, timestamp "
-            "FROM alerts ORDER BY timestamp DESC LIMIT ?",
-            (limit,),
-        )
-    rows = await cursor.fetchall()
-    return [_normalize_alert_row(r) for r in rows]
+    async with _reader() as conn:
+        if since:
+            cursor = await conn.execute(
+                "SELECT normalized_json "
+                "FROM alerts WHERE timestamp >= ? ORDER BY timestamp DESC LIMIT ?",
+                (since, limit),
+            )
+        else:
+            cursor = await conn.execute(
+                "SELECT normalized_json "
+                "FROM alerts ORDER BY timestamp DESC LIMIT ?",
+                (limit,),
+            )
+        rows = await cursor.fetchall()
+    return [orjson.loads(r["normalized_json"]) for r in rows]
 
 
+@_cached_query
 async def get_alert_stats() -> Dict[str, Any]:
     """Get basic statistics about stored alerts."""
     if not _db:
         return {"total_alerts": 0, "total_city_entries": 0, "top_cities": []}
-    cur = await _db.execute("SELECT COUNT(*) as c FROM alerts")
-    total = (await cur.fetchone())["c"]
-    cur2 = await _db.execute("SELECT COUNT(*) as c FROM city_alerts")
-    total_cities = (await cur2.fetchone())["c"]
-    cur3 = await _db.execute(
-        "SELECT c.name as city, COUNT(*) as cnt FROM city_alerts ca "
-        "JOIN cities c ON ca.city_id = c.id "
-        "GROUP BY ca.city_id ORDER BY cnt DESC LIMIT 10"
-    )
-    top = [{"city": r["city"], "count": r["cnt"]} for r in await cur3.fetchall()]
-    return {"total_alerts": total, "total_city_entries": total_cities, "top_cities": top}
+    async with _reader() as conn:
+        cur = await conn.execute(
+            "SELECT (SELECT COUNT(*) FROM alerts) as total, (SELECT COUNT(*) FROM city_alerts) as total_cities"
+        )
+        counts = await cur.fetchone()
+        cur2 = await conn.execute(
+            "SELECT c.name as city, COUNT(*) as cnt FROM city_alerts ca "
+            "JOIN cities c ON ca.city_id = c.id "
+            "GROUP BY ca.city_id ORDER BY cnt DESC LIMIT 10"
+        )
+        top = [{"city": r["city"], "count": r["cnt"]} for r in await cur2.fetchall()]
+    return {"total_alerts": counts["total"], "total_city_entries": counts["total_cities"], "top_cities": top}
 
 
 async def get_all_cities() -> List[Dict[str, Any]]:
     """Return all known cities as [{id, name}, ...]."""
     if not _db:
         return []
-    cursor = await _db.execute("SELECT id, name FROM cities ORDER BY name")
-    return [{"id": r["id"], "name": r["name"]} for r in await cursor.fetchall()]
+    async with _reader() as conn:
+        cursor = await conn.execute("SELECT id, name FROM cities ORDER BY name")
+        return [{"id": r["id"], "name": r["name"]} for r in await cursor.fetchall()]
 
 
 def resolve_city_ids(city_names: List[str]) -> List[int]:
@@ -1,12 +1,14 @@
 import asyncio
 import hashlib
 import httpx
-import json
 import logging
+import orjson
 from collections import defaultdict
-from ..core.alert_queue import alert_queue
-from ..core.state import app_state
-from ..db.database import save_alert, resolve_city_ids
+from typing import Union
+from ..core.alert_queue import alert_hub
+from ..core.state import app_state, is_duplicate_alert
+from ..db.database import optimize_db, save_alert, save_alerts, resolve_city_ids
+from .sse import encode_alert_event
 
 logger = logging.getLogger(__name__)
 
@@ -19,62 +21,78 @@ REQUEST_HEADERS = {
     "X-Requested-With": "XMLHttpRequest",
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
 }
+# Polling cadence: every POLL_INTERVAL_SECONDS while quiet (the original fixed interval, which
+# bounds how late a new alert can be noticed). On startup and right after an alert the poller
+# runs at POLL_FAST_INTERVAL_SECONDS to catch follow-up salvos, then eases back by
+# POLL_EASE_BACK_FACTOR per poll with nothing new. The alert hint wakes it at any point.
+POLL_FAST_INTERVAL_SECONDS = 0.5
 POLL_INTERVAL_SECONDS = 2
+POLL_EASE_BACK_FACTOR = 1.5
 POLL_BACKOFF_ON_403 = 30  # Wait 30s before retrying after a 403
+UTF8_BOM = b"\xef\xbb\xbf"
+# Cities containing this word ("test") belong to test alerts, which are not broadcast
+TEST_ALERT_MARKER = "בדיקה"
 
-def get_alert_type_by_category(category: int) -> str:
-    """Maps an alert category ID to its type."""
-    alert_types = {
-        1: "missiles",
-        2: "radiologicalEvent",
-        3: "earthQuake",
-        4: "tsunami",
-        5: "hostileAircraftIntrusion",
-        6: "hazardousMaterials",
-        7: "terroristInfiltration",
-        8: "missilesDrill",
-        9: "earthQuakeDrill",
-        10: "radiologicalEventDrill",
-        11: "tsunamiDrill",
-        12: "hostileAircraftIntrusionDrill",
-        13: "hazardousMaterialsDrill",
-        14: "terroristInfiltrationDrill",
-        20: "newsFlash", # As per the node.js library, earlyWarning is now newsFlash
-        99: "unknown",
-    }
-    return alert_types.get(category, "unknown")
+# Alert category ID -> alert type
+ALERT_TYPES = {
+    1: "missiles",
+    2: "radiologicalEvent",
+    3: "earthQuake",
+    4: "tsunami",
+    5: "hostileAircraftIntrusion",
+    6: "hazardousMaterials",
+    7: "terroristInfiltration",
+    8: "missilesDrill",
+    9: "earthQuakeDrill",
+    10: "radiologicalEventDrill",
+    11: "tsunamiDrill",
+    12: "hostileAircraftIntrusionDrill",
+    13: "hazardousMaterialsDrill",
+    14: "terroristInfiltrationDrill",
+    20: "newsFlash", # As per the node.js library, earlyWarning is now newsFlash
+    99: "unknown",
+}
+# The alerts API sends the category as a string ("1"), so the map is also keyed by the
+# string form and either one resolves with a single lookup
+_ALERT_TYPES_BY_KEY = {**ALERT_TYPES, **{str(cat): alert_type for cat, alert_type in ALERT_TYPES.items()}}
+
+def get_alert_type_by_category(category: Union[int, str]) -> str:
+    """Maps an alert category ID (int or numeric string) to its type."""
+    return _ALERT_TYPES_BY_KEY.get(category, "unknown")
 
 async def fetch_and_process_alerts(client: httpx.AsyncClient, url: str):
-    """Fetches alerts from a given URL and processes them."""
-    response = await client.get(url, headers=REQUEST_HEADERS)
+    """Fetches alerts from a given URL and processes them. The client is expected to send REQUEST_HEADERS."""
+    response = await client.get(url)
     response.raise_for_status()
 
-    text = response.content.decode("utf-8-sig").strip()
-    if not text:
+    # orjson parses the UTF-8 bytes directly; only the BOM and whitespace need stripping
+    body = response.content.removeprefix(UTF8_BOM).strip()
+    if not body:
         return None
 
     try:
-        alert_data = json.loads(text)
+        alert_data = orjson.loads(body)
         return alert_data
-    except json.JSONDecodeError:
-        logger.error(f"Failed to decode JSON from response: '{text}'")
+    except orjson.JSONDecodeError:
+        logger.error(f"Failed to decode JSON from response: '{body.decode('utf-8', 'replace')}'")
         return None
 
 
 async def sync_history(client: httpx.AsyncClient):
     """
     Fetch from the oref.org.il history API and backfill all missing alerts into DB.
+    The client is expected to send REQUEST_HEADERS.
     The history API returns per-city entries, so we group them by (alertDate, title, category)
     into proper alert objects before saving.
     """
     try:
-        response = await client.get(POHA_HISTORY_URL, headers=REQUEST_HEADERS)
+        response = await client.get(POHA_HISTORY_URL)
         response.raise_for_status()
-        text = response.content.decode("utf-8-sig").strip()
-        if not text:
+        body = response.content.removeprefix(UTF8_BOM).strip()
+        if not body:
             return 0
 
-        history = json.loads(text)
+        history = orjson.loads(body)
         if not isinstance(history, list):
             logger.warning("History API returned non-list data")
             return 0
@@ -98,28 +116,27 @@ async def sync_history(client: httpx.AsyncClient):
             if city not in g["cities"]:
                 g["cities"].append(city)
 
-        # Save each group as an alert
-        saved = 0
+        # Build every group's alert, then save them all in one batch
+        alert_objs = []
         for key, g in groups.items():
-            # Generate a stable ID from the group key
-            alert_id = hashlib.md5(key.encode()).hexdigest()[:16]
+            # Generate a stable ID from the group key. Changing the hash would re-insert every
+            # already-synced alert under a new ID, so it stays MD5 (not used for security)
+            alert_id = hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()[:16]
             # Convert alertDate "YYYY-MM-DD HH:MM:SS" to ISO format
             iso_ts = g["alertDate"].replace(" ", "T")
-            alert_obj = {
+            alert_objs.append({
                 "id": alert_id,
                 "cat": g["category"],
                 "title": g["title"],
                 "desc": g["title"],
-                "type": get_alert_type_by_category(int(g["category"]) if g["category"].isdigit() else 0),
+                "type": get_alert_type_by_category(g["category"]),
                 "cities": g["cities"],
                 "data": g["cities"],
                 "timestamp": iso_ts,
-            }
-            try:
-                await save_alert(alert_obj)
-                saved += 1
-            except Exception:
-                pass  # INSERT OR IGNORE handles duplicates
+            })
+        # INSERT OR IGNORE skips alerts that are already stored
+        await save_alerts(alert_objs)
+        saved = len(alert_objs)
 
         logger.info(f"History sync: processed {len(groups)} alert groups from {len(history)} entries, saved {saved}")
         return saved
@@ -132,68 +149,109 @@ async def sync_history(client: httpx.AsyncClient):
         logger.error(f"History sync error: {e}", exc_info=True)
     return 0
 
+async def wait_for_next_poll(interval: float):
+    """Sleeps until the next poll is due, waking early if app_state.alert_hint is set."""
+    hint = app_state.alert_hint
+    try:
+        await asyncio.wait_for(hint.wait(), timeout=interval)
+    except asyncio.TimeoutError:
+        return
+    hint.clear()
+
+async def periodic_history_sync(client: httpx.AsyncClient):
+    """
+    Backfills missing alerts from the history API on startup, then syncs every
+    HISTORY_SYNC_INTERVAL seconds and lets SQLite re-optimize.
+    """
+    logger.info("Running initial history sync from oref.org.il...")
+    await sync_history(client)
+    while True:
+        await asyncio.sleep(HISTORY_SYNC_INTERVAL)
+        logger.info("Running periodic history sync...")
+        await sync_history(client)
+        try:
+            await optimize_db()
+        except Exception as e:
+            logger.error(f"PRAGMA optimize failed: {e}")
+
 async def poll_for_alerts():
     """
     Polls the Pikud Haoref API periodically for new alerts.
 
-    If a new alert is found, it is put into the shared alert_queue.
+    If a new alert is found, it is published to every SSE client through the alert_hub.
+    Polls every POLL_INTERVAL_SECONDS while quiet. A new alert speeds polling up to
+    POLL_FAST_INTERVAL_SECONDS, and it eases back to the regular interval while the API
+    has nothing new - no alert, or the one already published.
     Also syncs from the oref history API on startup and every HISTORY_SYNC_INTERVAL seconds.
     """
-    async with httpx.AsyncClient() as client:
-        # Initial history sync on startup — backfill all missing alerts
-        logger.info("Running initial history sync from oref.org.il...")
-        await sync_history(client)
-        last_history_sync = asyncio.get_event_loop().time()
-
-        while True:
-            try:
-                # Periodic history sync
-                now = asyncio.get_event_loop().time()
-                if now - last_history_sync >= HISTORY_SYNC_INTERVAL:
-                    logger.info("Running periodic history sync...")
-                    await sync_history(client)
-                    last_history_sync = now
-
-                alert_data = await fetch_and_process_alerts(client, POHA_API_URL)
-
-                if not alert_data:
-                    await asyncio.sleep(POLL_INTERVAL_SECONDS)
-                    continue
-
-                # The history API is no longer polled here, so we don't need to check for list type
-                current_id = alert_data.get("id")
-                if alert_data and current_id != app_state.last_alert_id:
-                    # Filter out test alerts
-                    cities = [city.strip() for city in alert_data.get("data", []) if "בדיקה" not in city]
-                    if not cities:
-                        logger.info(f"Ignoring test alert: {alert_data}")
-                        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+    # One long-lived HTTP/2 client: both APIs share a kept-alive connection, and the
+    # browser-like headers are set once instead of on every request
+    async with httpx.AsyncClient(
+        http2=True,
+        headers=REQUEST_HEADERS,
+        timeout=httpx.Timeout(5.0, connect=3.0),
+        limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60),
+    ) as client:
+        # History syncs, including the startup backfill, run alongside the poll loop,
+        # so the first poll doesn't wait for the history download
+        history_task = asyncio.create_task(periodic_history_sync(client))
+        interval = POLL_FAST_INTERVAL_SECONDS
+
+        try:
+            while True:
+                try:
+                    alert_data = await fetch_and_process_alerts(client, POHA_API_URL)
+
+                    if not alert_data:
+                        interval = min(interval * POLL_EASE_BACK_FACTOR, POLL_INTERVAL_SECONDS)
+                        await wait_for_next_poll(interval)
                         continue
 
-                    structured_alert = {
-                        "id": current_id,
-                        "cat": alert_data.get("cat"),
-                        "type": get_alert_type_by_category(alert_data.get("cat")),
-                        "title": alert_data.get("title"),
-                        "cities": cities,
-                        "city_ids": resolve_city_ids(cities),
-                        "instructions": alert_data.get("title")
-                    }
+                    # The history API is no longer polled here, so we don't need to check for list type
+                    current_id = alert_data.get("id")
+                    if alert_data and current_id != app_state.last_alert_id:
+                        # Filter out test alerts
+                        cities = [city.strip() for city in alert_data.get("data", []) if TEST_ALERT_MARKER not in city]
+                        if not cities:
+                            logger.info(f"Ignoring test alert: {alert_data}")
+                            await wait_for_next_poll(interval)
+                            continue
+
+                        structured_alert = {
+                            "id": current_id,
+                            "cat": alert_data.get("cat"),
+                            "type": get_alert_type_by_category(alert_data.get("cat")),
+                            "title": alert_data.get("title"),
+                            "cities": cities,
+                            "city_ids": resolve_city_ids(cities),
+                            "instructions": alert_data.get("title")
+                        }
                     
-                    app_state.last_alert_id = current_id
-                    logger.info(f"New alert detected: {structured_alert}")
-                    await alert_queue.put(structured_alert)
-                    await save_alert(structured_alert)
-
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 403:
-                    logger.warning(f"403 Forbidden from oref.org.il — likely geo-blocked (non-Israeli IP). Retrying in {POLL_BACKOFF_ON_403}s.")
-                    await asyncio.sleep(POLL_BACKOFF_ON_403)
-                    continue
-                logger.error(f"HTTP error from oref API: {e}")
-            except httpx.RequestError as e:
-                logger.error(f"A network error occurred while requesting alerts: {e}")
-            except Exception as e:
-                logger.error(f"An unexpected error occurred in poller: {e}", exc_info=True)
-
-            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+                        app_state.last_alert_id = current_id
+                        # Same category and cities as an alert broadcast moments ago: it has a new ID,
+                        # so it's still stored, but clients aren't alerted twice
+                        if is_duplicate_alert(alert_data.get("cat"), cities):
+                            logger.info(f"Not re-broadcasting duplicate alert {current_id} for {cities}")
+                        else:
+                            interval = POLL_FAST_INTERVAL_SECONDS
+                            logger.info(f"New alert detected: {structured_alert}")
+                            alert_hub.publish(encode_alert_event(structured_alert))
+                        await save_alert(structured_alert)
+                    else:
+                        # The alert already published is still being served; nothing new, so ease back
+                        interval = min(interval * POLL_EASE_BACK_FACTOR, POLL_INTERVAL_SECONDS)
+
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 403:
+                        logger.warning(f"403 Forbidden from oref.org.il — likely geo-blocked (non-Israeli IP). Retrying in {POLL_BACKOFF_ON_403}s.")
+                        await asyncio.sleep(POLL_BACKOFF_ON_403)
+                        continue
+                    logger.error(f"HTTP error from oref API: {e}")
+                except httpx.RequestError as e:
+                    logger.error(f"A network error occurred while requesting alerts: {e}")
+                except Exception as e:
+                    logger.error(f"An unexpected error occurred in poller: {e}", exc_info=True)
+
+                await wait_for_next_poll(interval)
+        finally:
+            history_task.cancel()
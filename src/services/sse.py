@@ -1,33 +1,106 @@
 import asyncio
-import json
 import logging
-from ..core.alert_queue import alert_queue
+import zlib
+from typing import Any, AsyncIterator, Dict, Union
+
+import orjson
+from ..core.alert_queue import alert_hub
 from fastapi import Request
 
 logger = logging.getLogger(__name__)
 
+# Headers for SSE responses: no caching, and stop reverse proxies (nginx) from buffering events
+SSE_HEADERS = {"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Accel-Buffering": "no"}
+
+# Maximum number of queued alerts written to the client in a single chunk
+MAX_BATCH_FRAMES = 32
+
+# Seconds without an alert before a keep-alive comment is sent. A client that went away is
+# dropped when the server notices the disconnect, at the latest when this write fails.
+KEEP_ALIVE_INTERVAL_SECONDS = 15
+
+
+async def aiter_sse_data(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Yields the data payload of each event in a raw SSE byte stream.
+
+    Events are split on blank lines; comment-only events (e.g. ": keep-alive")
+    carry no data and are skipped without being decoded.
+    """
+    buf = bytearray()
+    async for chunk in chunks:
+        buf.extend(chunk)
+        while (end := buf.find(b"\n\n")) != -1:
+            event = bytes(buf[:end])
+            del buf[:end + 2]
+            data = [line[6:] for line in event.split(b"\n") if line.startswith(b"data: ")]
+            if data:
+                yield b"\n".join(data)
+
+
+def encode_alert_event(alert: Dict[str, Any]) -> bytes:
+    """
+    Serializes an alert into a complete SSE frame.
+
+    Producers that already know the payload can enqueue the resulting bytes
+    so the event generator streams them without re-encoding.
+    """
+    return b"event: new_alert\ndata: " + orjson.dumps(alert) + b"\n\n"
+
+
+def _format_alert(alert: Union[Dict[str, Any], bytes]) -> bytes:
+    """Formats a queued alert as an SSE frame; pre-encoded frames are returned as-is."""
+    if isinstance(alert, bytes):
+        return alert
+    return encode_alert_event(alert)
+
+
+async def gzip_event_stream(events: AsyncIterator[Union[str, bytes]]) -> AsyncIterator[bytes]:
+    """
+    Gzip-compresses an SSE stream.
+
+    The compressor is sync-flushed after every chunk so each event reaches the
+    client immediately instead of waiting for the compression buffer to fill.
+    """
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    async for chunk in events:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
 async def alert_event_generator(request: Request):
     """
     Yields server-sent events for new alerts.
 
-    This generator waits for new alerts to be placed in the alert_queue
-    and sends them to the client in the SSE format.
+    This generator subscribes to the alert_hub for as long as the client is
+    connected and sends each published alert to the client in the SSE format.
     """
     try:
-        while True:
-            # Check if the client has disconnected
-            if await request.is_disconnected():
-                logger.warning("Client disconnected, stopping alert stream.")
-                break
-
-            try:
-                # Wait for a new alert from the queue, with a timeout
-                alert = await asyncio.wait_for(alert_queue.get(), timeout=1.0)
-                # Format and yield the alert as an SSE message
-                yield f"event: new_alert\ndata: {json.dumps(alert)}\n\n"
-            except asyncio.TimeoutError:
-                # If no alert is received, send a keep-alive comment
-                yield ": keep-alive\n\n"
+        with alert_hub.subscribe() as queue:
+            while True:
+                # Check if the client has disconnected
+                if await request.is_disconnected():
+                    logger.warning("Client disconnected, stopping alert stream.")
+                    break
+
+                try:
+                    # Wait for a new alert from the hub, with a timeout
+                    alert = await asyncio.wait_for(queue.get(), timeout=KEEP_ALIVE_INTERVAL_SECONDS)
+                    frames = [_format_alert(alert)]
+                    # During a burst, drain what is already queued and send it in one write
+                    while len(frames) < MAX_BATCH_FRAMES:
+                        try:
+                            frames.append(_format_alert(queue.get_nowait()))
+                        except asyncio.QueueEmpty:
+                            break
+                    if len(frames) == 1:
+                        yield frames[0]
+                    else:
+                        yield b"".join(frames)
+                except asyncio.TimeoutError:
+                    # If no alert is received, send a keep-alive comment
+                    yield ": keep-alive\n\n"
     except Exception as e:
         logger.error(f"An unexpected error occurred in event generator: {e}")
         # Optionally, re-raise or handle specific exceptions
@@ -1,22 +1,46 @@
+import hmac
+import ipaddress
 import logging
 import os
-from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import FrozenSet, Optional, Union
 
 import geoip2.database
 from fastapi import HTTPException, Request, Depends
 from geoip2.errors import AddressNotFoundError
+from maxminddb import MODE_MEMORY
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 from fastapi.security import APIKeyHeader
-from .geolocation import get_geoip_reader
 
 logger = logging.getLogger(__name__)
 
 # --- API Key Authentication ---
-API_KEY = os.getenv("API_KEY")
+# API_KEY is the primary key (also used by the internal SSE gateway and MCP server);
+# API_KEYS optionally lists additional accepted keys, comma-separated.
+API_KEYS = frozenset(
+    key.strip()
+    for key in [os.getenv("API_KEY", ""), *os.getenv("API_KEYS", "").split(",")]
+    if key.strip()
+)
 API_KEY_NAME = "X-API-Key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
+# The "authentication disabled" warning is logged for the first request only
+_api_key_warned = False
+
+def _key_matches(api_key: str, keys: FrozenSet[str]) -> bool:
+    """
+    Constant-time check of a presented key against every configured key.
+
+    Every key is compared, whatever its length, and nothing is cached, so neither the
+    timing nor attacker-chosen guesses reveal or disturb anything about the valid keys.
+    """
+    presented = api_key.encode()
+    matched = False
+    for key in keys:
+        matched |= hmac.compare_digest(presented, key.encode())
+    return matched
 
 async def get_api_key(api_key: str = Depends(api_key_header)):
     """
@@ -24,83 +48,158 @@ async def get_api_key(api_key: str = Depends(api_key_header)):
     
     Raises HTTPException 401 if the key is missing or invalid.
     """
-    if not API_KEY:
+    global _api_key_warned
+    if not API_KEYS:
         # If the server has no API_KEY configured, authentication is disabled.
         # This allows the service to run without security for local development.
-        logger.warning("API_KEY not configured. Allowing request without authentication.")
+        if not _api_key_warned:
+            _api_key_warned = True
+            logger.warning("API_KEY not configured. Allowing requests without authentication.")
         return None
         
     if not api_key:
         logger.warning("API key missing from request.")
         raise HTTPException(status_code=401, detail="API key is missing")
         
-    if api_key != API_KEY:
+    if not _key_matches(api_key, API_KEYS):
         logger.warning("Invalid API key received.")
         raise HTTPException(status_code=401, detail="Invalid API key")
     
     return api_key
 
+# --- Client IP ---
+# Only this much of X-Forwarded-For is looked at; the client's address comes first
+MAX_FORWARDED_FOR_LENGTH = 256
+
+# Marks a request whose client address hasn't been parsed yet (None means "not a valid address")
+_UNRESOLVED = object()
+
+def _client_address(request: Request) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    """
+    Returns the client's IP address, or None if it isn't a valid address.
+
+    Behind a proxy the client is the first entry of X-Forwarded-For; otherwise
+    it's the direct peer. The result is stored on request.state, so the geo check
+    and the rate limiter key share one parse per request.
+    """
+    address = getattr(request.state, "client_address", _UNRESOLVED)
+    if address is not _UNRESOLVED:
+        return address
+
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if forwarded_for:
+        ip = forwarded_for[:MAX_FORWARDED_FOR_LENGTH].split(",", 1)[0].strip()
+    else:
+        ip = request.client.host if request.client else ""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        address = None
+    request.state.client_address = address
+    return address
+
+def _client_ip(request: Request) -> Optional[str]:
+    """Returns the client's IP address in canonical form, or None if it isn't a valid address."""
+    address = _client_address(request)
+    return str(address) if address else None
+
 # --- Rate Limiting Setup ---
 # The key function uses the client's IP address to identify them.
-limiter = Limiter(key_func=get_remote_address)
+# Counters live in this process by default; with several workers, point RATE_LIMIT_STORAGE_URI
+# at a shared store (e.g. redis://host:6379, needs the redis package) so limits apply globally.
+# The moving window is checked atomically by the store (a Lua script on Redis).
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT_STRATEGY = "moving-window"
+limiter = Limiter(
+    key_func=lambda request: _client_ip(request) or get_remote_address(request),
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+)
 
 # Load the path to the GeoIP database from an environment variable
 # This is crucial for keeping paths and sensitive info out of the code.
 GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH")
 
-@asynccontextmanager
-async def get_geoip_reader():
-    """
-    An asynchronous context manager to safely open and close the GeoIP database.
-    Yields a database reader object.
-    """
+# Shared GeoIP reader, opened once at startup. The Country database (a few MB) is read fully
+# into memory, so lookups never wait on page faults and run directly on the event loop.
+# Each worker process holds its own copy.
+_geoip_reader: Optional[geoip2.database.Reader] = None
+
+def open_geoip_reader():
+    """Opens the shared GeoIP reader. Called once on application startup."""
+    global _geoip_reader
+    if _geoip_reader:
+        return
     if not GEOIP_DB_PATH or not os.path.exists(GEOIP_DB_PATH):
         logger.warning("GEOIP_DB_PATH is not configured or the file does not exist. Geo-restriction is disabled.")
-        yield None
         return
+    # Cached countries may come from a previous copy of the database
+    _lookup_country.cache_clear()
+    try:
+        _geoip_reader = geoip2.database.Reader(GEOIP_DB_PATH, mode=MODE_MEMORY)
+    except Exception as e:
+        logger.error(f"Failed to load GeoIP database: {e}. Geo-restriction is disabled.")
+
+def close_geoip_reader():
+    """Closes the shared GeoIP reader on application shutdown."""
+    global _geoip_reader
+    if _geoip_reader:
+        _geoip_reader.close()
+        _geoip_reader = None
+    _lookup_country.cache_clear()
+
+def get_geoip_reader() -> Optional[geoip2.database.Reader]:
+    """Returns the shared GeoIP reader, or None if geo-restriction is disabled."""
+    return _geoip_reader
 
-    reader = None
+@lru_cache(maxsize=4096)
+def _lookup_country(ip: str) -> Optional[str]:
+    """
+    Returns the ISO country code for an IP, or None if the database doesn't know it.
+
+    Cached because SSE clients reconnect from the same addresses; only call it
+    when a reader is available.
+    """
     try:
-        reader = geoip2.database.Reader(GEOIP_DB_PATH)
-        yield reader
-    finally:
-        if reader:
-            reader.close()
+        return get_geoip_reader().country(ip).country.iso_code
+    except AddressNotFoundError:
+        return None
 
-async def geo_ip_middleware(request: Request, call_next):
+async def require_israel_ip(request: Request):
     """
-    FastAPI middleware to perform geo-restriction based on client IP.
+    FastAPI dependency that restricts a route to clients in Israel ('IL').
 
-    It checks if the incoming request is for the alert stream and, if so,
-    validates that the client's IP address originates from Israel ('IL').
+    Attached only to the protected routes, so other requests never pay for
+    the check. Fails open: requests are allowed when geo-restriction is
+    disabled or the client's location can't be determined.
     """
-    # We only want to protect the actual data stream endpoint
-    if request.url.path == "/api/alerts-stream":
-        # In a production setup behind a proxy, the client IP is often in this header.
-        # Fallback to the direct request IP if the header is not present.
-        client_ip = request.headers.get("X-Forwarded-For", request.client.host)
-
-        async with get_geoip_reader() as reader:
-            if reader:
-                try:
-                    response = reader.country(client_ip)
-                    # Check if the country code is NOT Israel
-                    if response.country.iso_code != "IL":
-                        logger.warning(f"Blocking request from non-IL IP: {client_ip} ({response.country.name})")
-                        raise HTTPException(
-                            status_code=403,
-                            detail="Access denied: This service is only available in Israel.",
-                        )
-                except AddressNotFoundError:
-                    logger.warning(f"Could not find location for IP: {client_ip}. Allowing request.")
-                except Exception as e:
-                    logger.error(f"An unexpected error occurred during GeoIP lookup: {e}", exc_info=True)
-                    # If the exception is the one we're deliberately raising, re-raise it.
-                    if isinstance(e, HTTPException):
-                        raise
-                    # Otherwise, fail open for other unexpected errors.
-            # If the reader is None (not configured), the request is allowed to pass.
-
-    # Proceed to the actual endpoint
-    response = await call_next(request)
-    return response 
\ No newline at end of file
+    reader = get_geoip_reader()
+    if not reader:
+        # Geo-restriction is not configured
+        return
+
+    # In a production setup behind a proxy, the client IP is in X-Forwarded-For.
+    client_address = _client_address(request)
+    if client_address is None:
+        logger.warning("Could not parse the client IP address. Allowing request.")
+        return
+    if client_address.is_private or client_address.is_loopback or client_address.is_link_local:
+        # Local and private networks aren't in the GeoIP database; they'd be allowed
+        # as unknown anyway, so skip the lookup
+        return
+
+    client_ip = str(client_address)
+    try:
+        country = _lookup_country(client_ip)
+    except Exception as e:
+        # Fail open for unexpected lookup errors
+        logger.error(f"An unexpected error occurred during GeoIP lookup: {e}", exc_info=True)
+        return
+    if country is None:
+        logger.warning(f"Could not find location for IP: {client_ip}. Allowing request.")
+    elif country != "IL":
+        logger.warning(f"Blocking request from non-IL IP: {client_ip} ({country})")
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied: This service is only available in Israel.",
+        )
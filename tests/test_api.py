@@ -1,19 +1,12 @@
+import asyncio
 import os
 import pytest
-from unittest.mock import patch, AsyncMock
-from fastapi.testclient import TestClient
+from unittest.mock import patch
 
 # Set environment for testing
 os.environ["API_KEY"] = "test-key"
 
-# Mock the infinite background tasks before importing main
-with patch('src.services.polling.poll_for_alerts', new=AsyncMock()):
-    from src.api.main import app
-
-@pytest.fixture
-def client():
-    """Test client fixture with fresh state for each test"""
-    return TestClient(app)
+from src.api.main import _persist_worker, _stop_persist_worker
 
 def test_root_endpoint(client):
     """
@@ -23,7 +16,7 @@ def test_root_endpoint(client):
     assert response.status_code == 200
     assert response.json() == {"message": "Welcome to the Pikud Haoref Real-Time Alert Service"}
 
-@patch('src.utils.security.API_KEY', 'test-key')
+@patch('src.utils.security.API_KEYS', frozenset({'test-key'}))
 @patch('src.api.main.alert_event_generator')
 def test_alerts_stream_requires_api_key(mock_generator, client):
     """
@@ -34,7 +27,7 @@ def test_alerts_stream_requires_api_key(mock_generator, client):
     assert response.status_code == 401
     assert "API key is missing" in response.text
 
-@patch('src.utils.security.API_KEY', 'test-key')
+@patch('src.utils.security.API_KEYS', frozenset({'test-key'}))
 @patch('src.api.main.alert_event_generator')
 def test_alerts_stream_with_invalid_api_key(mock_generator, client):
     """
@@ -46,7 +39,7 @@ def test_alerts_stream_with_invalid_api_key(mock_generator, client):
     assert response.status_code == 401
     assert "Invalid API key" in response.text
 
-@patch('src.utils.security.API_KEY', 'test-key')
+@patch('src.utils.security.API_KEYS', frozenset({'test-key'}))
 @patch('src.api.main.alert_event_generator')
 def test_alerts_stream_with_valid_api_key(mock_generator, client):
     """
@@ -61,4 +54,81 @@ def test_alerts_stream_with_valid_api_key(mock_generator, client):
     
     headers = {"X-API-Key": "test-key"}
     response = client.get("/api/alerts-stream", headers=headers)
-    assert response.status_code == 200 
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_fake_alert_rejects_unknown_category(client):
+    """
+    Tests that an unknown alert category is rejected when the request is parsed.
+    """
+    response = client.post("/api/test/fake-alert", json={"data": ["Tel Aviv"], "cat": "999"})
+    assert response.status_code == 422
+
+@patch('src.api.main.PERSIST_PUT_TIMEOUT_SECONDS', 0.01)
+def test_fake_alert_rejected_when_persist_queue_is_full(client):
+    """
+    Tests that a fake alert is rejected with 503 instead of buffered
+    without limit when the background writer can't keep up, and that a
+    retry is rejected again rather than reported as an already-sent duplicate.
+    """
+    full_queue = asyncio.Queue(maxsize=1)
+    full_queue.put_nowait({"id": "pending"})
+
+    with patch('src.api.main._persist_queue', full_queue):
+        response = client.post("/api/test/fake-alert", json={"data": ["Queue Test City"]})
+        # A retry must not be mistaken for a duplicate of the alert that was never sent
+        retry = client.post("/api/test/fake-alert", json={"data": ["Queue Test City"]})
+
+    assert response.status_code == 503
+    assert retry.status_code == 503
+    assert full_queue.qsize() == 1
+
+@pytest.mark.asyncio
+async def test_persist_worker_commits_in_flight_batch_on_shutdown():
+    """
+    Tests that stopping the persist worker waits for the batch it is
+    already saving, and anything still queued, instead of cancelling it.
+    """
+    queue = asyncio.Queue()
+    saving = asyncio.Event()
+    saved = []
+
+    async def slow_save(batch):
+        saving.set()
+        await asyncio.sleep(0.01)
+        saved.extend(alert["id"] for alert in batch)
+
+    with patch('src.api.main._persist_queue', queue), \
+         patch('src.api.main.save_alerts', side_effect=slow_save):
+        worker = asyncio.create_task(_persist_worker())
+        queue.put_nowait({"id": "in-flight"})
+        await asyncio.wait_for(saving.wait(), timeout=1)
+        queue.put_nowait({"id": "queued"})
+
+        await asyncio.wait_for(_stop_persist_worker(worker), timeout=1)
+
+    assert saved == ["in-flight", "queued"]
+    assert worker.cancelled()
+
+@pytest.mark.asyncio
+@patch('src.api.main.PERSIST_SHUTDOWN_TIMEOUT_SECONDS', 0.05)
+async def test_persist_worker_stop_gives_up_when_saves_hang(caplog):
+    """
+    Tests that shutdown doesn't hang when the database can't be written,
+    and logs how many alerts were dropped.
+    """
+    queue = asyncio.Queue()
+
+    async def stuck_save(batch):
+        await asyncio.Event().wait()
+
+    with patch('src.api.main._persist_queue', queue), \
+         patch('src.api.main.save_alerts', side_effect=stuck_save):
+        worker = asyncio.create_task(_persist_worker())
+        queue.put_nowait({"id": "in-flight"})
+        await asyncio.sleep(0)
+        queue.put_nowait({"id": "queued"})
+
+        await asyncio.wait_for(_stop_persist_worker(worker), timeout=1)
+
+    assert worker.cancelled()
+    assert "dropping 2 unsaved alert(s)" in caplog.text
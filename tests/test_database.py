@@ -1,6 +1,7 @@
 import pytest
 import os
 import asyncio
+import sqlite3
 from unittest.mock import patch, AsyncMock
 from src.db import database
 
@@ -46,6 +47,33 @@ async def test_save_and_get_recent_alerts(test_db):
     assert "תל אביב - יפו" in recent[0]["data"]
 
 
+@pytest.mark.asyncio
+async def test_save_alerts_batch(test_db):
+    """Test saving several alerts in one call."""
+    alerts = [
+        {"id": "batch-1", "title": "A", "category": "1", "data": ["אשקלון"]},
+        {"id": "batch-2", "title": "B", "category": "1", "data": ["אשקלון", "שדרות"]},
+    ]
+    await database.save_alerts(alerts)
+
+    recent = await database.get_recent_alerts(limit=10)
+    assert {a["id"] for a in recent} == {"batch-1", "batch-2"}
+    by_city = await database.get_alerts_by_city("אשקלון")
+    assert len(by_city) == 2
+
+
+@pytest.mark.asyncio
+async def test_query_cache_is_invalidated_on_save(test_db):
+    """Test that cached reads are served until a new alert is written."""
+    await database.save_alert({"id": "cache-1", "data": ["נתיבות"]})
+    first = await database.get_recent_alerts(limit=10)
+    assert await database.get_recent_alerts(limit=10) is first
+
+    await database.save_alert({"id": "cache-2", "data": ["נתיבות"]})
+    second = await database.get_recent_alerts(limit=10)
+    assert {a["id"] for a in second} == {"cache-1", "cache-2"}
+
+
 @pytest.mark.asyncio
 async def test_get_alerts_by_city(test_db):
     """Test filtering alerts by city."""
@@ -66,6 +94,27 @@ async def test_get_alerts_by_city(test_db):
     assert len(tlv) == 0
 
 
+@pytest.mark.asyncio
+async def test_get_alerts_by_city_finds_cities_added_by_another_process(test_db):
+    """Test that a city missing from this process's cache is looked up in the DB instead of returning nothing."""
+    # Written through a separate connection, as the poller process would, bypassing this process's cache
+    with sqlite3.connect(test_db) as other:
+        city_id = other.execute("INSERT INTO cities (name) VALUES ('נתיבות')").lastrowid
+        other.execute(
+            "INSERT INTO alerts (id, timestamp, normalized_json) VALUES ('other-1', '2024-01-01T10:00:00', ?)",
+            (b'{"id":"other-1"}',),
+        )
+        other.execute(
+            "INSERT INTO city_alerts (alert_id, city_id, timestamp) VALUES ('other-1', ?, '2024-01-01T10:00:00')",
+            (city_id,),
+        )
+
+    alerts = await database.get_alerts_by_city("נתיבות")
+
+    assert [a["id"] for a in alerts] == ["other-1"]
+    assert database._city_cache["נתיבות"] == city_id
+
+
 @pytest.mark.asyncio
 async def test_get_alert_stats(test_db):
     """Test alert statistics."""
@@ -100,3 +149,170 @@ async def test_get_recent_alerts_with_since(test_db):
     since = await database.get_recent_alerts(limit=50, since="2025-01-01T00:00:00")
     assert len(since) == 1
     assert since[0]["id"] == "new-1"
+
+
+@pytest.mark.asyncio
+async def test_save_alerts_rolls_back_failed_batch(test_db):
+    """Test that a failing batch stores nothing and forgets the city IDs it created."""
+    alerts = [
+        {"id": "ok-1", "data": ["אופקים"]},
+        {"id": "bad-1", "data": ["באר שבע"], "extra": {"not", "serializable"}},
+    ]
+    with pytest.raises(TypeError):
+        await database.save_alerts(alerts)
+
+    assert "אופקים" not in database._city_cache
+    assert await database.get_all_cities() == []
+    assert await database.get_recent_alerts(limit=10) == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_saves_are_all_stored(test_db):
+    """Test that a live alert saved while a history batch is being written is not lost."""
+    history = [{"id": f"hist-{i}", "data": [f"city-{i % 50}"]} for i in range(500)]
+    live = {"id": "live-1", "data": ["שדרות"]}
+
+    await asyncio.gather(database.save_alerts(history), database.save_alert(live))
+
+    recent = await database.get_recent_alerts(limit=100)
+    assert "live-1" in {a["id"] for a in recent}
+    cursor = await database._db.execute("SELECT COUNT(*) FROM alerts")
+    assert (await cursor.fetchone())[0] == 501
+
+
+@pytest.mark.asyncio
+async def test_init_db_tunes_page_cache_and_page_size(test_db):
+    """Test that a fresh database gets the larger page size and page cache."""
+    page_size = await (await database._db.execute("PRAGMA page_size")).fetchone()
+    cache_size = await (await database._db.execute("PRAGMA cache_size")).fetchone()
+    assert page_size[0] == 8192
+    assert cache_size[0] == -65536
+
+
+@pytest.mark.asyncio
+async def test_reads_use_read_only_pool_connections(test_db):
+    """Test that reads run on read-only connections and see committed writes."""
+    await database.save_alert({"id": "pool-1", "data": ["אילת"]})
+
+    results = await asyncio.gather(*(database.get_alerts_by_city("אילת", limit=i) for i in range(1, 7)))
+
+    assert all(r[0]["id"] == "pool-1" for r in results)
+    assert database._readers.qsize() == database.DATABASE_READERS
+    async with database._reader() as conn:
+        query_only = await (await conn.execute("PRAGMA query_only")).fetchone()
+    assert query_only[0] == 1
+
+
+@pytest.mark.asyncio
+async def test_init_db_is_idempotent(test_db):
+    """Test that initializing an open database keeps the existing connections."""
+    writer = database._db
+    await database.init_db()
+    assert database._db is writer
+    assert len(database._reader_conns) == database.DATABASE_READERS
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_init_db_calls_share_one_setup(test_db):
+    """Test that tool calls racing to initialize the DB open it once and all find the reader pool ready."""
+    await database.close_db()
+
+    async def init_and_read():
+        await database.init_db()
+        return await database.get_all_cities()
+
+    with patch.object(database, '_init_lock', asyncio.Lock()), \
+         patch.object(database, '_connect', wraps=database._connect) as mock_connect:
+        assert await asyncio.gather(init_and_read(), init_and_read()) == [[], []]
+
+    assert mock_connect.call_count == 1 + database.DATABASE_READERS
+    assert len(database._reader_conns) == database.DATABASE_READERS
+
+
+@pytest.mark.asyncio
+async def test_cache_city_ids_reuses_existing_rows(test_db):
+    """Test that resolving cities already in the DB (but not cached) returns their existing IDs."""
+    await database._cache_city_ids(["דימונה", "ערד", "דימונה"])
+    first = dict(database._city_cache)
+    database._city_cache.clear()
+
+    await database._cache_city_ids(["ערד", "דימונה", "ירוחם"])
+    await database._db.commit()
+
+    assert database._city_cache["דימונה"] == first["דימונה"]
+    assert database._city_cache["ערד"] == first["ערד"]
+    assert len(await database.get_all_cities()) == 3
+
+
+@pytest.mark.asyncio
+async def test_cache_city_ids_without_returning_support(test_db):
+    """Test the INSERT OR IGNORE + SELECT fallback used on SQLite older than 3.35."""
+    await database._cache_city_ids(["טבריה"])
+    database._city_cache.clear()
+
+    with patch.object(database, '_HAS_RETURNING', False):
+        await database._cache_city_ids(["טבריה", "צפת"])
+    await database._db.commit()
+
+    assert set(database._city_cache) == {"טבריה", "צפת"}
+    assert len(await database.get_all_cities()) == 2
+
+
+@pytest.mark.asyncio
+async def test_city_lookup_is_served_by_covering_index(test_db):
+    """Test that the per-city query scans the covering index without a sort step."""
+    cursor = await database._db.execute(
+        "EXPLAIN QUERY PLAN SELECT a.id FROM city_alerts ca JOIN alerts a ON ca.alert_id = a.id "
+        "WHERE ca.city_id = ? ORDER BY ca.timestamp DESC LIMIT ?",
+        (1, 10),
+    )
+    plan = " ".join(row["detail"] for row in await cursor.fetchall())
+    assert "COVERING INDEX idx_city_alerts_city_ts_alert" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.asyncio
+async def test_reads_return_alert_normalized_at_write_time(test_db):
+    """Test that stored alerts come back normalized, with the category as stored text."""
+    await database.save_alert({"id": "norm-1", "cat": 1, "instructions": "היכנסו למרחב המוגן", "type": "missiles", "cities": ["קצרין"]})
+
+    alert = (await database.get_alerts_by_city("קצרין"))[0]
+
+    assert alert["category"] == "1"
+    assert alert["title"] == "היכנסו למרחב המוגן"
+    assert alert["type"] == "missiles"
+    assert alert["city_ids"] == [database._city_cache["קצרין"]]
+
+
+@pytest.mark.asyncio
+async def test_init_db_backfills_normalized_json(test_db):
+    """Test that alerts stored without normalized_json get it on the next startup."""
+    await database._db.execute(
+        "INSERT INTO alerts (id, title, category, data_json, raw_json, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+        ("legacy-1", "Legacy", "2", '["רהט"]', '{"type": "earthQuake"}', "2024-01-01T00:00:00"),
+    )
+    await database._db.commit()
+    await database.close_db()
+    await database.init_db()
+
+    recent = await database.get_recent_alerts(limit=10)
+
+    assert recent[0]["id"] == "legacy-1"
+    assert recent[0]["data"] == ["רהט"]
+    assert recent[0]["type"] == "earthQuake"
+
+
+@pytest.mark.asyncio
+async def test_recent_alerts_are_served_by_timestamp_index(test_db):
+    """Test that both recent-alerts queries walk the timestamp index without a sort step."""
+    for where, params in (("", (10,)), ("WHERE timestamp >= ? ", ("2025-01-01", 10))):
+        cursor = await database._db.execute(
+            f"EXPLAIN QUERY PLAN SELECT normalized_json FROM alerts {where}ORDER BY timestamp DESC LIMIT ?",
+            params,
+        )
+        plan = " ".join(row["detail"] for row in await cursor.fetchall())
+        assert "INDEX idx_alerts_timestamp" in plan
+        assert "TEMP B-TREE" not in plan
+
+    cursor = await database._db.execute("SELECT name FROM sqlite_master WHERE name = 'idx_alerts_recent'")
+    assert await cursor.fetchone() is None
@@ -0,0 +1,199 @@
+import asyncio
+import time
+import httpx
+import pytest
+import respx
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from unittest.mock import Mock, patch
+
+from src.core import mcp_server
+from src.core.mcp_server import POHA_HISTORY_API_URL, AlertSubscriber, check_current_alerts, get_alert_history
+
+HISTORY_BODY = (
+    '﻿{"alertDate": "2024-01-01 10:00:00", "data": "קריית שמונה", "category": 1}'
+    '{"alertDate": "2024-01-01 10:01:00", "data": "אשקלון", "category": 1}'
+).encode()
+
+@pytest.fixture(autouse=True)
+def empty_history_cache():
+    """Makes every test fetch the history from the (mocked) API."""
+    with patch.dict(mcp_server._history_cache, clear=True):
+        yield
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_alert_history_falls_back_to_fuzzy_city_match():
+    """
+    Tests that a misspelled city name that matches nothing exactly still
+    finds its alerts through fuzzy matching.
+    """
+    respx.get(POHA_HISTORY_API_URL).mock(return_value=httpx.Response(200, content=HISTORY_BODY))
+
+    result = await get_alert_history(cities=["קרית שמונה"])
+
+    assert "fuzzy match for ['קרית שמונה']" in result
+    assert "קריית שמונה" in result
+    assert "אשקלון" not in result
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_alert_history_prefers_exact_city_match():
+    """
+    Tests that exact city matches are returned without the fuzzy pass.
+    """
+    respx.get(POHA_HISTORY_API_URL).mock(return_value=httpx.Response(200, content=HISTORY_BODY))
+
+    result = await get_alert_history(cities=["אשקלון"])
+
+    assert "exact match for ['אשקלון']" in result
+    assert "קריית שמונה" not in result
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_alert_history_serves_repeat_calls_from_cache():
+    """
+    Tests that history is fetched from the API once and later calls,
+    including concurrent ones, reuse the cached result.
+    """
+    route = respx.get(POHA_HISTORY_API_URL).mock(return_value=httpx.Response(200, content=HISTORY_BODY))
+
+    await asyncio.gather(get_alert_history(), get_alert_history())
+    result = await get_alert_history(cities=["אשקלון"])
+
+    assert route.call_count == 1
+    assert "אשקלון" in result
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_history_misses_share_one_failed_fetch():
+    """
+    Tests that callers waiting on an in-flight fetch get its error too,
+    rather than each retrying the API.
+    """
+    async def slow_failure(request):
+        await asyncio.sleep(0.01)
+        raise httpx.ConnectError("down")
+
+    route = respx.get(POHA_HISTORY_API_URL).mock(side_effect=slow_failure)
+
+    results = await asyncio.gather(get_alert_history(), get_alert_history())
+
+    assert route.call_count == 1
+    assert all("network error" in result for result in results)
+    assert not mcp_server._history_inflight
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_alert_history_parses_newline_separated_objects():
+    """
+    Tests that an object stream the '}{' splice can't handle (objects on
+    separate lines) is still parsed.
+    """
+    body = HISTORY_BODY.replace(b'}{', b'}\r\n{')
+    respx.get(POHA_HISTORY_API_URL).mock(return_value=httpx.Response(200, content=body))
+
+    result = await get_alert_history()
+
+    assert "showing 2 alerts" in result
+
+@pytest.mark.asyncio
+async def test_check_current_alerts_does_not_wait_when_connected():
+    """
+    Tests that checking alerts on an established subscription returns
+    immediately instead of pausing for the connection.
+    """
+    subscriber = AlertSubscriber("http://localhost:8000/api/alerts-stream", "key")
+    subscriber.start_subscription = Mock()
+    subscriber._set_connected(True)
+
+    with patch.object(mcp_server, 'alert_subscriber', subscriber), \
+         patch.object(mcp_server, 'last_alert', {"id": "a-1", "cities": ["אשקלון"]}):
+        result = await asyncio.wait_for(check_current_alerts(), timeout=0.5)
+
+    assert "a-1" in result
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_stale_history_is_served_while_refreshing():
+    """
+    Tests that history past its TTL is returned immediately and replaced
+    by a background refresh.
+    """
+    route = respx.get(POHA_HISTORY_API_URL).mock(return_value=httpx.Response(200, content=HISTORY_BODY))
+    stale_alerts = [{"alertDate": "2023-12-31 09:00:00", "data": "שדרות"}]
+    fetched_at = time.monotonic() - mcp_server.HISTORY_CACHE_TTL_SECONDS - 1
+    mcp_server._history_cache[POHA_HISTORY_API_URL] = (fetched_at, mcp_server._build_alert_history(stale_alerts))
+
+    result = await get_alert_history()
+    await asyncio.gather(*mcp_server._history_refresh_tasks)
+    refreshed = await get_alert_history()
+
+    assert "שדרות" in result
+    assert route.call_count == 1
+    assert "אשקלון" in refreshed
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_alert_history_matches_cities_in_list_data():
+    """
+    Tests that alerts whose 'data' is a list of cities match a requested
+    city exactly, ignoring case.
+    """
+    body = b'[{"alertDate": "2024-01-01 10:00:00", "data": ["Sderot", "Ashkelon"]}, {"alertDate": "2024-01-01 10:01:00", "data": ["Ashdod"]}]'
+    respx.get(POHA_HISTORY_API_URL).mock(return_value=httpx.Response(200, content=body))
+
+    result = await get_alert_history(cities=["ashkelon"])
+
+    assert "Sderot, Ashkelon" in result
+    assert "Ashdod" not in result
+
+def test_http_app_marks_event_streams_unbuffered():
+    """
+    Tests that SSE responses from the MCP HTTP app carry the header that
+    stops reverse proxies from buffering them.
+    """
+    async def events(request):
+        return PlainTextResponse("data: ping\n\n", media_type="text/event-stream")
+
+    app = Starlette(routes=[Route("/events", events)], middleware=mcp_server.HTTP_MIDDLEWARE)
+
+    with TestClient(app) as client:
+        response = client.get("/events")
+
+    assert response.headers["x-accel-buffering"] == "no"
+
+def test_reconnect_delay_backs_off_with_jitter():
+    """
+    Tests that reconnect delays double per attempt, add up to a second of
+    jitter, and stay capped.
+    """
+    subscriber = AlertSubscriber("http://localhost:8000/api/alerts-stream", "key")
+
+    delays = []
+    for attempt in (1, 3, 10):
+        subscriber.reconnect_attempts = attempt
+        delays.append(subscriber.next_reconnect_delay())
+
+    assert 2 <= delays[0] <= 3
+    assert 8 <= delays[1] <= 9
+    assert subscriber.max_reconnect_delay <= delays[2] <= subscriber.max_reconnect_delay + 1
+
+def test_build_alert_history_normalizes_alerts_into_parallel_arrays():
+    """
+    Tests that each alert's display areas, date and lowercased data are
+    stored at the same index, and non-dict entries are dropped.
+    """
+    history = mcp_server._build_alert_history([
+        {"alertDate": "2024-01-01 10:00:00", "data": ["Sderot", "Ashkelon"]},
+        "not an alert",
+        {"data": "Ashdod"},
+    ])
+
+    assert history.data_display == ["Sderot, Ashkelon", "Ashdod"]
+    assert history.alert_dates == ["2024-01-01 10:00:00", "N/A"]
+    assert history.data_lower[1] == "ashdod"
+    assert history.city_index["ashkelon"] == [0]
+    assert history.text_index["ashdod"] == [1]
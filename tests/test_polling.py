@@ -1,17 +1,50 @@
 import asyncio
+import time
 import pytest
 import respx
-from httpx import Response
-from unittest.mock import AsyncMock, patch
-from src.services.polling import poll_for_alerts, POHA_API_URL, POHA_HISTORY_URL, get_alert_type_by_category
+from httpx import AsyncClient, Response
+from unittest.mock import AsyncMock, Mock, patch
+from src.services import polling
+from src.services.sse import encode_alert_event
+from src.core.state import is_duplicate_alert, DUPLICATE_WINDOW_SECONDS
+from src.services.polling import fetch_and_process_alerts, poll_for_alerts, periodic_history_sync, sync_history, wait_for_next_poll, POHA_API_URL, POHA_HISTORY_URL, get_alert_type_by_category, POLL_FAST_INTERVAL_SECONDS, POLL_INTERVAL_SECONDS
 
 # Helper to create a mock alert
 def create_mock_alert(alert_id, cat, data, title):
     return {"id": alert_id, "cat": cat, "data": data, "title": title}
 
+@pytest.fixture
+def poller():
+    """
+    Patches the poller's state, hub and storage, and replaces the wait between
+    polls with one that sets an event and then blocks, so a test can await
+    exactly one poll cycle instead of sleeping.
+    """
+    polled = asyncio.Event()
+
+    async def wait_after_poll(interval):
+        polled.set()
+        await asyncio.Event().wait()
+
+    with patch('src.services.polling.app_state') as mock_state, \
+         patch('src.services.polling.alert_hub') as mock_hub, \
+         patch('src.services.polling.save_alert', new=AsyncMock()), \
+         patch('src.services.polling.wait_for_next_poll', side_effect=wait_after_poll):
+        mock_state.last_alert_id = None
+        yield mock_state, mock_hub, polled
+
+async def run_one_poll(polled):
+    """Runs the poller until its first poll cycle finishes, then stops it."""
+    polling_task = asyncio.create_task(poll_for_alerts())
+    try:
+        await asyncio.wait_for(polled.wait(), timeout=1.0)
+    finally:
+        polling_task.cancel()
+        await asyncio.gather(polling_task, return_exceptions=True)
+
 @pytest.mark.asyncio
 @respx.mock
-async def test_poll_for_alerts_new_alert_found_on_primary():
+async def test_poll_for_alerts_new_alert_found_on_primary(poller):
     """
     Tests that a new alert from the primary API is structured correctly and queued.
     """
@@ -19,34 +52,26 @@ async def test_poll_for_alerts_new_alert_found_on_primary():
     respx.get(POHA_API_URL).mock(return_value=Response(200, json=mock_alert))
     respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
 
-    with patch('src.services.polling.app_state') as mock_state, \
-         patch('src.services.polling.alert_queue') as mock_queue, \
-         patch('src.services.polling.save_alert', new=AsyncMock()):
-        mock_state.last_alert_id = None
-        mock_queue.put = AsyncMock()
+    mock_state, mock_hub, polled = poller
 
-        polling_task = asyncio.create_task(poll_for_alerts())
-        await asyncio.sleep(0.1)
-
-        assert mock_state.last_alert_id == "12345"
-        expected_alert = {
-            "id": "12345",
-            "cat": 1,
-            "type": "missiles",
-            "title": "Enter Shelters",
-            "cities": ["Tel Aviv"],
-            "city_ids": [],
-            "instructions": "Enter Shelters"
-        }
-        mock_queue.put.assert_called_with(expected_alert)
+    await run_one_poll(polled)
 
-        polling_task.cancel()
-        await asyncio.gather(polling_task, return_exceptions=True)
+    assert mock_state.last_alert_id == "12345"
+    expected_alert = {
+        "id": "12345",
+        "cat": 1,
+        "type": "missiles",
+        "title": "Enter Shelters",
+        "cities": ["Tel Aviv"],
+        "city_ids": [],
+        "instructions": "Enter Shelters"
+    }
+    mock_hub.publish.assert_called_with(encode_alert_event(expected_alert))
 
 
 @pytest.mark.asyncio
 @respx.mock
-async def test_poll_for_alerts_no_new_alert():
+async def test_poll_for_alerts_no_new_alert(poller):
     """
     Tests that if the poller sees the same alert ID again, it does not queue a duplicate.
     """
@@ -54,24 +79,17 @@ async def test_poll_for_alerts_no_new_alert():
     respx.get(POHA_API_URL).mock(return_value=Response(200, json=mock_alert))
     respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
 
-    with patch('src.services.polling.app_state') as mock_state, \
-         patch('src.services.polling.alert_queue') as mock_queue, \
-         patch('src.services.polling.save_alert', new=AsyncMock()):
-        mock_state.last_alert_id = "12345"
-        mock_queue.put = AsyncMock()
-
-        polling_task = asyncio.create_task(poll_for_alerts())
-        await asyncio.sleep(0.1)
+    mock_state, mock_hub, polled = poller
+    mock_state.last_alert_id = "12345"
 
-        mock_queue.put.assert_not_called()
+    await run_one_poll(polled)
 
-        polling_task.cancel()
-        await asyncio.gather(polling_task, return_exceptions=True)
+    mock_hub.publish.assert_not_called()
 
 
 @pytest.mark.asyncio
 @respx.mock
-async def test_poll_for_alerts_filters_test_alerts():
+async def test_poll_for_alerts_filters_test_alerts(poller):
     """
     Tests that alerts containing the test keyword are ignored.
     """
@@ -79,42 +97,90 @@ async def test_poll_for_alerts_filters_test_alerts():
     respx.get(POHA_API_URL).mock(return_value=Response(200, json=mock_alert))
     respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
 
-    with patch('src.services.polling.app_state') as mock_state, \
-         patch('src.services.polling.alert_queue') as mock_queue, \
-         patch('src.services.polling.save_alert', new=AsyncMock()):
-        mock_state.last_alert_id = None
-        mock_queue.put = AsyncMock()
+    mock_state, mock_hub, polled = poller
 
-        polling_task = asyncio.create_task(poll_for_alerts())
-        await asyncio.sleep(0.1)
-
-        mock_queue.put.assert_not_called()
-        assert mock_state.last_alert_id is None
+    await run_one_poll(polled)
 
-        polling_task.cancel()
-        await asyncio.gather(polling_task, return_exceptions=True)
+    mock_hub.publish.assert_not_called()
+    assert mock_state.last_alert_id is None
 
 
 @pytest.mark.asyncio
 @respx.mock
-async def test_poll_for_alerts_handles_api_errors_gracefully():
+async def test_poll_for_alerts_handles_api_errors_gracefully(poller):
     """
     Tests that the poller handles HTTP errors from the API without crashing.
     """
     respx.get(POHA_API_URL).mock(return_value=Response(500))
     respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
 
-    with patch('src.services.polling.alert_queue') as mock_queue, \
-         patch('src.services.polling.save_alert', new=AsyncMock()):
-        mock_queue.put = AsyncMock()
+    _, mock_hub, polled = poller
 
-        polling_task = asyncio.create_task(poll_for_alerts())
-        await asyncio.sleep(0.1)
+    await run_one_poll(polled)
 
-        mock_queue.put.assert_not_called()
+    mock_hub.publish.assert_not_called()
 
-        polling_task.cancel()
-        await asyncio.gather(polling_task, return_exceptions=True)
+@pytest.mark.asyncio
+async def test_wait_for_next_poll_wakes_on_hint():
+    """
+    Tests that setting the alert hint cuts the poll interval short and is reset afterwards.
+    """
+    with patch('src.services.polling.app_state') as mock_state:
+        mock_state.alert_hint = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.05, mock_state.alert_hint.set)
+
+        await asyncio.wait_for(wait_for_next_poll(10), timeout=1)
+
+        assert not mock_state.alert_hint.is_set()
+
+def test_is_duplicate_alert_within_window():
+    """
+    Tests that an identical alert (same category and cities, any order) is a
+    duplicate within the window, and that a different alert is not.
+    """
+    assert not is_duplicate_alert(1, ["Tel Aviv", "Ramat Gan"])
+    assert is_duplicate_alert("1", ["Ramat Gan", "Tel Aviv"])
+    assert not is_duplicate_alert(1, ["Haifa"])
+
+    with patch('src.core.state.time.monotonic', return_value=time.monotonic() + DUPLICATE_WINDOW_SECONDS + 1):
+        assert not is_duplicate_alert(1, ["Tel Aviv", "Ramat Gan"])
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_poll_for_alerts_stores_duplicate_with_new_id_without_rebroadcast(poller):
+    """
+    Tests that an alert repeating one just broadcast, under a new ID, is stored
+    and marked as seen but not broadcast again.
+    """
+    mock_alert = create_mock_alert("200", 1, ["Tel Aviv"], "Enter Shelters")
+    respx.get(POHA_API_URL).mock(return_value=Response(200, json=mock_alert))
+    respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
+    mock_state, mock_hub, polled = poller
+    is_duplicate_alert(1, ["Tel Aviv"])
+
+    await run_one_poll(polled)
+
+    mock_hub.publish.assert_not_called()
+    polling.save_alert.assert_awaited_once()
+    assert polling.save_alert.await_args.args[0]["id"] == "200"
+    assert mock_state.last_alert_id == "200"
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_fake_alert_does_not_suppress_real_alert(poller):
+    """
+    Tests that a fake test alert for the same category and cities doesn't stop
+    the real alert from being broadcast.
+    """
+    mock_alert = create_mock_alert("300", 1, ["Tel Aviv"], "Enter Shelters")
+    respx.get(POHA_API_URL).mock(return_value=Response(200, json=mock_alert))
+    respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
+    _, mock_hub, polled = poller
+    is_duplicate_alert("1", ["Tel Aviv"], source="fake")
+
+    await run_one_poll(polled)
+
+    mock_hub.publish.assert_called_once()
 
 def test_get_alert_type_by_category():
     """
@@ -123,4 +189,151 @@ def test_get_alert_type_by_category():
     assert get_alert_type_by_category(1) == "missiles"
     assert get_alert_type_by_category(5) == "hostileAircraftIntrusion"
     assert get_alert_type_by_category(20) == "newsFlash"
-    assert get_alert_type_by_category(999) == "unknown" # Test fallback
\ No newline at end of file
+    assert get_alert_type_by_category(999) == "unknown" # Test fallback
+
+def test_get_alert_type_by_category_accepts_string_ids():
+    """
+    Tests that categories sent as strings, as the live alerts API does, map to the same types.
+    """
+    assert get_alert_type_by_category("1") == "missiles"
+    assert get_alert_type_by_category("20") == "newsFlash"
+    assert get_alert_type_by_category("") == "unknown"
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_sync_history_saves_all_groups_in_one_batch():
+    """
+    Tests that per-city history entries are grouped into alerts and saved with a single call.
+    """
+    history = [
+        {"alertDate": "2024-01-01 10:00:00", "title": "ירי רקטות", "category": 1, "data": "שדרות"},
+        {"alertDate": "2024-01-01 10:00:00", "title": "ירי רקטות", "category": 1, "data": "אשקלון"},
+        {"alertDate": "2024-01-01 11:00:00", "title": "ירי רקטות", "category": 1, "data": "אשדוד"},
+    ]
+    respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=history))
+
+    with patch('src.services.polling.save_alerts', new=AsyncMock()) as mock_save:
+        async with AsyncClient() as client:
+            saved = await sync_history(client)
+
+    assert saved == 2
+    mock_save.assert_awaited_once()
+    batch = mock_save.await_args.args[0]
+    assert [a["cities"] for a in batch] == [["שדרות", "אשקלון"], ["אשדוד"]]
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_fetch_and_process_alerts_parses_body_with_bom():
+    """
+    Tests that a UTF-8 BOM and surrounding whitespace in the API response are skipped.
+    """
+    body = '\ufeff{"id": "1", "data": ["שדרות"]}\r\n'.encode()
+    respx.get(POHA_API_URL).mock(return_value=Response(200, content=body))
+
+    async with AsyncClient() as client:
+        alert = await fetch_and_process_alerts(client, POHA_API_URL)
+
+    assert alert == {"id": "1", "data": ["שדרות"]}
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_sync_history_keeps_stable_alert_ids():
+    """
+    Tests that history alert IDs stay the same across syncs, so stored alerts are not duplicated.
+    """
+    history = [{"alertDate": "2024-01-01 10:00:00", "title": "ירי רקטות", "category": 1, "data": "שדרות"}]
+    respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=history))
+
+    with patch('src.services.polling.save_alerts', new=AsyncMock()) as mock_save:
+        async with AsyncClient() as client:
+            await sync_history(client)
+
+    assert mock_save.await_args.args[0][0]["id"] == "53b2c88849a27a70"
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_poll_for_alerts_eases_back_while_alert_is_unchanged():
+    """
+    Tests that repeatedly seeing the already-published alert slows polling from the fast
+    interval back to the regular one, and no further.
+    """
+    mock_alert = create_mock_alert("12345", 1, ["Tel Aviv"], "Enter Shelters")
+    respx.get(POHA_API_URL).mock(return_value=Response(200, json=mock_alert))
+    respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
+    intervals = []
+
+    async def record_wait(interval):
+        intervals.append(interval)
+        await asyncio.sleep(0)
+
+    with patch('src.services.polling.app_state') as mock_state, \
+         patch('src.services.polling.alert_hub'), \
+         patch('src.services.polling.wait_for_next_poll', side_effect=record_wait):
+        mock_state.last_alert_id = "12345"
+
+        polling_task = asyncio.create_task(poll_for_alerts())
+        while len(intervals) < 8:
+            await asyncio.sleep(0.01)
+        polling_task.cancel()
+        await asyncio.gather(polling_task, return_exceptions=True)
+
+    assert intervals[0] > POLL_FAST_INTERVAL_SECONDS
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == POLL_INTERVAL_SECONDS
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_poll_for_alerts_sends_browser_headers(poller):
+    """
+    Tests that the poller's shared client sends the headers oref.org.il expects on every request.
+    """
+    alerts_route = respx.get(POHA_API_URL).mock(return_value=Response(200, content=b""))
+    history_route = respx.get(POHA_HISTORY_URL).mock(return_value=Response(200, json=[]))
+
+    _, _, polled = poller
+
+    polling_task = asyncio.create_task(poll_for_alerts())
+    await asyncio.wait_for(polled.wait(), timeout=1.0)
+    while not history_route.called:
+        await asyncio.sleep(0)
+    polling_task.cancel()
+    await asyncio.gather(polling_task, return_exceptions=True)
+
+    for route in (alerts_route, history_route):
+        assert route.calls.last.request.headers["Referer"] == "https://www.oref.org.il/"
+
+@pytest.mark.asyncio
+async def test_periodic_history_sync_runs_every_interval():
+    """
+    Tests that the background history syncer syncs and optimizes the DB once per interval.
+    """
+    with patch('src.services.polling.HISTORY_SYNC_INTERVAL', 0.01), \
+         patch('src.services.polling.sync_history', new=AsyncMock()) as mock_sync, \
+         patch('src.services.polling.optimize_db', new=AsyncMock()) as mock_optimize:
+        task = asyncio.create_task(periodic_history_sync(Mock()))
+        while mock_sync.await_count < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert mock_optimize.await_count >= 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_first_poll_does_not_wait_for_initial_history_sync(poller):
+    """
+    Tests that the startup history backfill runs in the background, so a live alert is
+    published while the history download is still in progress.
+    """
+    mock_alert = create_mock_alert("777", 1, ["Sderot"], "Enter Shelters")
+    respx.get(POHA_API_URL).mock(return_value=Response(200, json=mock_alert))
+    _, mock_hub, polled = poller
+
+    async def slow_history_sync(client):
+        await asyncio.Event().wait()
+
+    with patch('src.services.polling.sync_history', side_effect=slow_history_sync) as mock_sync:
+        await run_one_poll(polled)
+
+    mock_sync.assert_called_once()
+    mock_hub.publish.assert_called_once()
@@ -1,35 +1,35 @@
 import pytest
 from unittest.mock import patch, Mock
 from fastapi import Request, HTTPException
-from fastapi.responses import Response
-from src.utils.security import geo_ip_middleware, get_api_key
-from src.utils.geolocation import MAXMIND_DB_PATH
+from maxminddb import MODE_MEMORY
+from src.utils import security
+from src.utils.security import close_geoip_reader, get_api_key, open_geoip_reader, require_israel_ip
 
-# A simple async function to be used as the 'call_next' argument in middleware
-async def mock_call_next(request: Request):
-    # In a real scenario, this would pass the request to the next middleware
-    # or the endpoint. For testing, we just need an awaitable that returns
-    # a mock response.
-    return Mock(status_code=200)
+@pytest.fixture(autouse=True)
+def clear_country_cache():
+    """Keeps cached GeoIP lookups from one test's mock reader out of the next test."""
+    security._lookup_country.cache_clear()
+    yield
+    security._lookup_country.cache_clear()
 
-@pytest.mark.asyncio
-async def test_geo_ip_middleware_allows_non_stream_requests():
+def test_geo_restriction_applies_only_to_stream_route():
     """
-    Tests that requests to endpoints other than '/api/alerts-stream' are not
-    checked and are allowed to pass through.
+    Tests that the Israel-only check is attached to '/api/alerts-stream'
+    and not run for the other endpoints.
     """
-    # Arrange: Create a mock request for a non-protected endpoint
-    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "client": ("1.2.3.4", 123)})
-    
-    # Act: Call the middleware
-    response = await geo_ip_middleware(request, mock_call_next)
+    from src.api.main import app
+
+    guarded = {
+        route.path
+        for route in app.routes
+        if any(dep.call is require_israel_ip for dep in getattr(route, "dependant", Mock(dependencies=[])).dependencies)
+    }
 
-    # Assert: The response should be the one from `mock_call_next`
-    assert response.status_code == 200
+    assert guarded == {"/api/alerts-stream"}
 
 @pytest.mark.asyncio
 @patch('src.utils.security.get_geoip_reader')
-async def test_geo_ip_middleware_allows_israel_ip(mock_get_reader):
+async def test_require_israel_ip_allows_israel_ip(mock_get_reader):
     """
     Tests that an IP address identified as being from Israel ('IL') is
     allowed to access the protected stream endpoint.
@@ -44,28 +44,23 @@ async def test_geo_ip_middleware_allows_israel_ip(mock_get_reader):
     mock_reader = Mock()
     mock_reader.country.return_value = mock_country_response
     
-    # Configure the patched async context manager to yield our mock reader
-    mock_get_reader.return_value.__aenter__.return_value = mock_reader
+    # Configure the patched getter to return our mock reader
+    mock_get_reader.return_value = mock_reader
     
     # Act
-    response = await geo_ip_middleware(request, mock_call_next)
+    assert await require_israel_ip(request) is None
     
     # Assert
-    assert response.status_code == 200
     mock_reader.country.assert_called_with('1.2.3.4')
 
 @pytest.mark.asyncio
 @patch('src.utils.security.get_geoip_reader')
-async def test_geo_ip_middleware_blocks_non_israel_ip(mock_get_reader):
+async def test_require_israel_ip_blocks_non_israel_ip(mock_get_reader):
     """
     Tests that an IP address from outside Israel is blocked with an
     HTTP 403 Forbidden error.
     """
     # Arrange
-    # A dummy 'call_next' function that the middleware will invoke
-    async def call_next(request):
-        return Response("OK")
-
     request = Request({
         "type": "http",
         "method": "GET",
@@ -80,31 +75,142 @@ async def test_geo_ip_middleware_blocks_non_israel_ip(mock_get_reader):
 
     mock_reader = Mock()
     mock_reader.country.return_value = mock_country_response
-    mock_get_reader.return_value.__aenter__.return_value = mock_reader
+    mock_get_reader.return_value = mock_reader
 
     # Act & Assert
     with pytest.raises(HTTPException) as exc_info:
-        await geo_ip_middleware(request, call_next)
+        await require_israel_ip(request)
     
     assert exc_info.value.status_code == 403
     assert "Access denied" in exc_info.value.detail
 
 @pytest.mark.asyncio
-async def test_geo_ip_middleware_allows_if_db_not_configured():
+async def test_require_israel_ip_allows_if_db_not_configured():
     """
     Tests that if the GeoIP database is not configured (path is None),
-    the middleware allows the request to proceed without performing an IP check.
-    """
-    with patch('src.utils.geolocation.MAXMIND_DB_PATH', None):
-        with patch('src.utils.security.get_geoip_reader') as mock_get_reader:
-            # Arrange
-            request = Request({"type": "http", "method": "GET", "path": "/api/alerts-stream", "headers": [], "client": ("1.2.3.4", 123)})
-
-            # Simulate the DB being unavailable
-            mock_get_reader.return_value.__aenter__.return_value = None
-            
-            # Act
-            response = await geo_ip_middleware(request, mock_call_next)
-            
-            # Assert
-            assert response.status_code == 200 
\ No newline at end of file
+    the dependency allows the request to proceed without performing an IP check.
+    """
+    with patch('src.utils.security.GEOIP_DB_PATH', None):
+        # Arrange: startup finds no database, so no reader is opened
+        open_geoip_reader()
+        request = Request({"type": "http", "method": "GET", "path": "/api/alerts-stream", "headers": [], "client": ("1.2.3.4", 123)})
+
+        # Act & Assert
+        assert security.get_geoip_reader() is None
+        assert await require_israel_ip(request) is None
+
+def test_geoip_reader_is_opened_once_and_shared(tmp_path):
+    """
+    Tests that the GeoIP database is loaded into memory once at startup and
+    the same reader is handed to every request until shutdown.
+    """
+    db_file = tmp_path / "GeoLite2-Country.mmdb"
+    db_file.write_bytes(b"")
+
+    with patch('src.utils.security.GEOIP_DB_PATH', str(db_file)), \
+         patch('src.utils.security.geoip2.database.Reader') as mock_reader_cls:
+        open_geoip_reader()
+        open_geoip_reader()
+        try:
+            mock_reader_cls.assert_called_once_with(str(db_file), mode=MODE_MEMORY)
+            assert security._geoip_reader is mock_reader_cls.return_value
+        finally:
+            close_geoip_reader()
+
+    mock_reader_cls.return_value.close.assert_called_once()
+    assert security._geoip_reader is None
+
+@pytest.mark.asyncio
+@patch('src.utils.security.get_geoip_reader')
+async def test_require_israel_ip_caches_country_per_ip(mock_get_reader):
+    """
+    Tests that repeat requests from the same IP reuse the cached country
+    instead of querying the GeoIP database again.
+    """
+    request = Request({"type": "http", "method": "GET", "path": "/api/alerts-stream", "headers": [], "client": ("1.2.3.4", 123)})
+    mock_reader = Mock()
+    mock_reader.country.return_value.country.iso_code = "IL"
+    mock_get_reader.return_value = mock_reader
+
+    for _ in range(3):
+        assert await require_israel_ip(request) is None
+
+    mock_reader.country.assert_called_once_with('1.2.3.4')
+
+@pytest.mark.parametrize("headers, client, expected", [
+    ([(b"x-forwarded-for", b"1.2.3.4, 10.0.0.1")], ("10.0.0.1", 123), "1.2.3.4"),
+    ([(b"x-forwarded-for", b" 2001:DB8::1 ")], ("10.0.0.1", 123), "2001:db8::1"),
+    ([], ("5.6.7.8", 123), "5.6.7.8"),
+    ([(b"x-forwarded-for", b"not-an-ip")], ("10.0.0.1", 123), None),
+    ([(b"x-forwarded-for", b"1" * 10_000)], ("10.0.0.1", 123), None),
+])
+def test_client_ip_uses_first_valid_forwarded_address(headers, client, expected):
+    """
+    Tests that the client IP is the first X-Forwarded-For entry (or the peer
+    address), normalized, and None when it isn't a valid address.
+    """
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "client": client})
+
+    assert security._client_ip(request) == expected
+
+def test_client_address_is_parsed_once_per_request():
+    """
+    Tests that the client address is stored on the request, so the geo check
+    and the rate limiter key don't each re-parse X-Forwarded-For.
+    """
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [(b"x-forwarded-for", b"1.2.3.4")], "client": ("10.0.0.1", 123)})
+
+    with patch('src.utils.security.ipaddress.ip_address', wraps=security.ipaddress.ip_address) as mock_parse:
+        assert security._client_ip(request) == "1.2.3.4"
+        assert security.limiter._key_func(request) == "1.2.3.4"
+
+    mock_parse.assert_called_once()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("presented, accepted", [
+    ("test-key", True),
+    ("another-longer-key", True),
+    ("test-kez", False),
+    ("x", False),
+])
+async def test_get_api_key_checks_every_configured_key(presented, accepted):
+    """
+    Tests that a key is accepted if it matches any configured key, and that
+    wrong keys are rejected whether or not their length matches a real key.
+    """
+    with patch('src.utils.security.API_KEYS', frozenset({'test-key', 'another-longer-key'})):
+        if accepted:
+            assert await get_api_key(api_key=presented) == presented
+        else:
+            with pytest.raises(HTTPException) as exc_info:
+                await get_api_key(api_key=presented)
+            assert exc_info.value.status_code == 401
+
+@pytest.mark.asyncio
+async def test_get_api_key_warns_once_when_auth_disabled(caplog):
+    """
+    Tests that with no API key configured, requests are allowed and the
+    warning is logged once rather than on every request.
+    """
+    with patch('src.utils.security.API_KEYS', frozenset()), \
+         patch('src.utils.security._api_key_warned', False):
+        for _ in range(3):
+            assert await get_api_key(api_key=None) is None
+
+    assert caplog.text.count("API_KEY not configured") == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("ip", ["127.0.0.1", "10.1.2.3", "192.168.1.10", "fd00::1"])
+@patch('src.utils.security.get_geoip_reader')
+async def test_require_israel_ip_allows_private_ips_without_lookup(mock_get_reader, ip):
+    """
+    Tests that loopback and private-network clients are allowed without
+    querying the GeoIP database.
+    """
+    request = Request({"type": "http", "method": "GET", "path": "/api/alerts-stream", "headers": [], "client": (ip, 123)})
+    mock_reader = Mock()
+    mock_get_reader.return_value = mock_reader
+
+    assert await require_israel_ip(request) is None
+
+    mock_reader.country.assert_not_called()
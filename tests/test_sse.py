@@ -1,14 +1,23 @@
 import asyncio
+import zlib
 import pytest
-from unittest.mock import Mock, AsyncMock
+from unittest.mock import Mock, AsyncMock, patch
 
-from src.services.sse import alert_event_generator
-from src.core.alert_queue import alert_queue
+from src.services.sse import aiter_sse_data, alert_event_generator, encode_alert_event, gzip_event_stream
+from src.core.alert_queue import AlertHub, alert_hub
+
+async def start_stream(request):
+    """Starts an alert stream and waits until it has subscribed to the hub."""
+    generator = alert_event_generator(request)
+    next_event = asyncio.ensure_future(generator.__anext__())
+    while not alert_hub.subscribers:
+        await asyncio.sleep(0)
+    return generator, next_event
 
 @pytest.mark.asyncio
 async def test_alert_event_generator_yields_formatted_alert():
     """
-    Tests that the generator takes an alert from the queue, formats it
+    Tests that the generator takes an alert from the hub, formats it
     correctly as an SSE message, and yields it.
     """
     # Arrange
@@ -16,16 +25,102 @@ async def test_alert_event_generator_yields_formatted_alert():
     mock_request.is_disconnected = AsyncMock(return_value=False)
     
     test_alert = {"id": "test1", "data": "This is a test alert"}
-    await alert_queue.put(test_alert)
 
     # Act
-    generator = alert_event_generator(mock_request)
-    output = await asyncio.wait_for(generator.__anext__(), timeout=1)
+    generator, next_event = await start_stream(mock_request)
+    alert_hub.publish(test_alert)
+    output = await asyncio.wait_for(next_event, timeout=1)
 
     # Assert
-    expected_output = 'event: new_alert\ndata: {"id": "test1", "data": "This is a test alert"}\n\n'
+    expected_output = b'event: new_alert\ndata: {"id":"test1","data":"This is a test alert"}\n\n'
     assert output == expected_output
 
+@pytest.mark.asyncio
+async def test_alert_event_generator_passes_through_encoded_frames():
+    """
+    Tests that frames serialized up front with encode_alert_event are
+    streamed as-is, without being re-encoded.
+    """
+    # Arrange
+    mock_request = Mock()
+    mock_request.is_disconnected = AsyncMock(return_value=False)
+
+    frame = encode_alert_event({"id": "test2", "data": ["תל אביב"]})
+
+    # Act
+    generator, next_event = await start_stream(mock_request)
+    alert_hub.publish(frame)
+    output = await asyncio.wait_for(next_event, timeout=1)
+
+    # Assert
+    assert output is frame
+    assert output == 'event: new_alert\ndata: {"id":"test2","data":["תל אביב"]}\n\n'.encode()
+
+@pytest.mark.asyncio
+async def test_alert_event_generator_batches_queued_frames():
+    """
+    Tests that alerts already waiting in the queue are sent together in one chunk.
+    """
+    # Arrange
+    mock_request = Mock()
+    mock_request.is_disconnected = AsyncMock(return_value=False)
+
+    first = encode_alert_event({"id": "a"})
+    second = encode_alert_event({"id": "b"})
+
+    # Act
+    generator, next_event = await start_stream(mock_request)
+    alert_hub.publish(first)
+    alert_hub.publish(second)
+    output = await asyncio.wait_for(next_event, timeout=1)
+
+    # Assert
+    assert output == first + second
+
+def test_alert_hub_fans_out_to_every_subscriber():
+    """
+    Tests that one published alert reaches every subscriber, and that
+    subscribers are removed when they leave.
+    """
+    hub = AlertHub()
+    frame = encode_alert_event({"id": "fan"})
+
+    with hub.subscribe() as first, hub.subscribe() as second:
+        hub.publish(frame)
+        assert first.get_nowait() is frame
+        assert second.get_nowait() is frame
+
+    assert not hub.subscribers
+
+def test_alert_hub_drops_oldest_alert_for_full_subscribers():
+    """
+    Tests that a subscriber whose queue is full does not block publishing
+    and keeps the newest alert.
+    """
+    hub = AlertHub(maxsize=1)
+
+    with hub.subscribe() as slow:
+        hub.publish(b"first")
+        hub.publish(b"second")
+        assert slow.qsize() == 1
+        assert slow.get_nowait() == b"second"
+    assert hub.dropped == 1
+
+@pytest.mark.asyncio
+async def test_gzip_event_stream_flushes_each_event():
+    """
+    Tests that every event is decodable as soon as its compressed chunk is sent.
+    """
+    async def events():
+        yield "event: new_alert\ndata: {}\n\n"
+        yield b"data: keep-alive\n\n"
+
+    chunks = [chunk async for chunk in gzip_event_stream(events())]
+
+    decompressor = zlib.decompressobj(wbits=31)
+    assert decompressor.decompress(chunks[0]) == b"event: new_alert\ndata: {}\n\n"
+    assert decompressor.decompress(chunks[1]) == b"data: keep-alive\n\n"
+
 @pytest.mark.asyncio
 async def test_alert_event_generator_stops_on_disconnect():
     """
@@ -40,19 +135,43 @@ async def test_alert_event_generator_stops_on_disconnect():
     # The generator should stop immediately and not yield anything
     with pytest.raises(StopAsyncIteration):
         await asyncio.wait_for(generator.__anext__(), timeout=1)
+    assert not alert_hub.subscribers
+
+@pytest.mark.asyncio
+async def test_alert_event_generator_sends_keep_alive_when_idle():
+    """
+    Tests that a keep-alive comment is sent once the keep-alive interval passes without alerts.
+    """
+    mock_request = Mock()
+    mock_request.is_disconnected = AsyncMock(return_value=False)
+
+    with patch('src.services.sse.KEEP_ALIVE_INTERVAL_SECONDS', 0.01):
+        generator = alert_event_generator(mock_request)
+        output = await asyncio.wait_for(generator.__anext__(), timeout=1)
+
+    assert output == ": keep-alive\n\n"
+    await generator.aclose()
 
 @pytest.fixture(autouse=True)
-async def clear_queue():
+async def clear_subscribers():
     """
-    A fixture to ensure the alert_queue is empty before and after each test.
+    A fixture to ensure no hub subscribers are left over between tests.
     This prevents state from leaking between tests.
     """
-    # Before test: ensure queue is empty
-    while not alert_queue.empty():
-        alert_queue.get_nowait()
-        
+    alert_hub.subscribers.clear()
     yield
-    
-    # After test: ensure queue is empty
-    while not alert_queue.empty():
-        alert_queue.get_nowait() 
\ No newline at end of file
+    alert_hub.subscribers.clear()
+
+@pytest.mark.asyncio
+async def test_aiter_sse_data_splits_events_across_chunks():
+    """
+    Tests that event payloads are reassembled across chunk boundaries and
+    that comment-only events are skipped.
+    """
+    async def chunks():
+        yield b": keep-alive\n\nevent: new_alert\ndata: {\"id\""
+        yield b": 1}\n\ndata: keep-alive\n\n"
+
+    payloads = [payload async for payload in aiter_sse_data(chunks())]
+
+    assert payloads == [b'{"id": 1}', b"keep-alive"]
@@ -0,0 +1,186 @@
+import asyncio
+import zlib
+from datetime import datetime
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+
+from src.api.sse_gateway import AlertSubscriber, Broadcaster, ClientLagged, broadcast_alert_to_clients, sse_generator
+
+@pytest.fixture
+def broadcaster():
+    """A fresh gateway broadcaster per test, so its Condition is bound to the test's event loop."""
+    fresh = Broadcaster()
+    with patch('src.api.sse_gateway.broadcaster', fresh):
+        yield fresh
+
+@pytest.mark.asyncio
+async def test_broadcaster_delivers_every_frame_since_last_seq():
+    """
+    Tests that a client waiting on the broadcaster receives all frames
+    published since the last sequence number it saw.
+    """
+    # Arrange
+    hub = Broadcaster()
+    waiter = asyncio.create_task(hub.wait_for_frames(0, timeout=1))
+    await asyncio.sleep(0)
+
+    # Act
+    await hub.publish(b"data: 1\n\n")
+    await hub.publish(b"data: 2\n\n")
+    last_seq, frames = await waiter
+    _, remaining = await hub.wait_for_frames(1, timeout=1)
+
+    # Assert
+    assert last_seq >= 1
+    assert frames[0] == b"data: 1\n\n"
+    assert remaining == [b"data: 2\n\n"]
+
+@pytest.mark.asyncio
+async def test_broadcaster_times_out_without_frames():
+    """
+    Tests that waiting with nothing published raises a timeout, which the
+    generator turns into a keep-alive message.
+    """
+    hub = Broadcaster()
+    with pytest.raises(asyncio.TimeoutError):
+        await hub.wait_for_frames(hub.seq, timeout=0.01)
+
+@pytest.mark.asyncio
+async def test_broadcaster_flags_clients_that_fell_out_of_history():
+    """
+    Tests that a client whose unsent frames were already dropped from the
+    history is told it lagged instead of silently missing alerts.
+    """
+    hub = Broadcaster(history=2)
+    for n in range(3):
+        await hub.publish(f"data: {n}\n\n".encode())
+
+    with pytest.raises(ClientLagged):
+        await hub.wait_for_frames(0, timeout=1)
+
+@pytest.mark.asyncio
+async def test_sse_generator_disconnects_lagging_client(broadcaster):
+    """
+    Tests that a slow client is disconnected rather than holding up or
+    being silently skipped by the broadcast.
+    """
+    generator = sse_generator(Mock())
+    await generator.__anext__()
+
+    for n in range(broadcaster.frames.maxlen + 1):
+        await broadcaster.publish(f"data: {n}\n\n".encode())
+
+    with pytest.raises(StopAsyncIteration):
+        await asyncio.wait_for(generator.__anext__(), timeout=1)
+    assert broadcaster.client_count == 0
+
+@pytest.mark.asyncio
+async def test_sse_generator_streams_broadcast_alerts(broadcaster):
+    """
+    Tests that a connected client gets the connection message followed by
+    broadcast alerts, and is unregistered when the stream closes.
+    """
+    # Arrange
+    generator = sse_generator(Mock())
+    connection_message = await generator.__anext__()
+    next_frame = asyncio.ensure_future(generator.__anext__())
+    await asyncio.sleep(0)
+
+    # Act
+    await broadcast_alert_to_clients({"id": "gw-1"})
+    frame = await asyncio.wait_for(next_frame, timeout=1)
+
+    # Assert
+    assert b'"type": "connection"' in connection_message
+    assert frame == b'data: {"id":"gw-1"}\n\n'
+    assert broadcaster.client_count == 1
+    await generator.aclose()
+    assert broadcaster.client_count == 0
+
+@pytest.mark.asyncio
+async def test_sse_generator_batches_frames_published_together(broadcaster):
+    """
+    Tests that alerts broadcast while the client was not waiting are sent
+    together in one chunk.
+    """
+    # Arrange
+    generator = sse_generator(Mock())
+    await generator.__anext__()
+
+    # Act
+    await broadcaster.publish(b"data: a\n\n")
+    await broadcaster.publish(b"data: b\n\n")
+    chunk = await asyncio.wait_for(generator.__anext__(), timeout=1)
+
+    # Assert
+    assert chunk == b"data: a\n\ndata: b\n\n"
+    await generator.aclose()
+
+@pytest.mark.asyncio
+async def test_sse_generator_gzip_stream_decodes_incrementally(broadcaster):
+    """
+    Tests that gzip clients get a valid gzip stream built from the shared,
+    precompressed frames, decodable chunk by chunk.
+    """
+    # Arrange
+    decoder = zlib.decompressobj(wbits=31)
+    generator = sse_generator(Mock(), gzip=True)
+    connection_message = decoder.decompress(await generator.__anext__())
+
+    # Act
+    await broadcaster.publish(b'data: {"id":"gw-1"}\n\n')
+    await broadcaster.publish(b'data: {"id":"gw-2"}\n\n')
+    chunk = decoder.decompress(await asyncio.wait_for(generator.__anext__(), timeout=1))
+
+    # Assert
+    assert b'"type": "connection"' in connection_message
+    assert chunk == b'data: {"id":"gw-1"}\n\ndata: {"id":"gw-2"}\n\n'
+    await generator.aclose()
+
+def test_reconnect_delay_grows_exponentially_up_to_cap():
+    """
+    Tests that reconnect delays double per attempt (plus jitter) and stay
+    below the configured maximum.
+    """
+    subscriber = AlertSubscriber("http://localhost:8000/api/alerts-stream", "key")
+
+    delays = []
+    for attempt in range(12):
+        subscriber.reconnect_attempts = attempt
+        delays.append(subscriber.next_reconnect_delay())
+
+    assert 0.5 <= delays[0] <= 1.0
+    assert 4.0 <= delays[3] <= 4.5
+    assert all(d <= subscriber.max_reconnect_delay + 0.5 for d in delays)
+
+@pytest.mark.asyncio
+async def test_process_alert_skips_recently_seen_ids():
+    """
+    Tests that an alert republished by the upstream with the same ID is
+    broadcast only once within the duplicate window.
+    """
+    subscriber = AlertSubscriber("http://localhost:8000/api/alerts-stream", "key")
+
+    with patch('src.api.sse_gateway.broadcast_alert_to_clients', new=AsyncMock()) as mock_broadcast:
+        await subscriber.process_alert({"id": "dup-1"})
+        await subscriber.process_alert({"id": "dup-1"})
+        await subscriber.process_alert({"id": "dup-2"})
+
+    assert [c.args[0]["id"] for c in mock_broadcast.call_args_list] == ["dup-1", "dup-2"]
+    await subscriber.client.aclose()
+
+def test_received_at_is_formatted_once_per_second():
+    """
+    Tests that the received_at timestamp is an ISO 8601 local time that is
+    reused while the wall-clock second doesn't change.
+    """
+    subscriber = AlertSubscriber("http://localhost:8000/api/alerts-stream", "key")
+
+    with patch('src.api.sse_gateway.time.time', return_value=1_700_000_000.2):
+        first = subscriber.received_at()
+        with patch('src.api.sse_gateway.time.strftime') as mock_strftime:
+            second = subscriber.received_at()
+
+    assert first == second
+    assert datetime.fromisoformat(first) == datetime.fromtimestamp(1_700_000_000)
+    mock_strftime.assert_not_called()